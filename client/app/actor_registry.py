@@ -0,0 +1,124 @@
+import math
+
+from .color import *
+
+# Actor categories used to split the actors of the world
+ACTOR_VEHICLE = 0
+ACTOR_TRAFFIC_LIGHT = 1
+ACTOR_SPEED_LIMIT = 2
+ACTOR_WALKER = 3
+ACTOR_OTHER = 4
+
+
+def truncate_display_name(name, truncate=250):
+    return (name[: truncate - 1] + "\u2026") if len(name) > truncate else name
+
+
+def get_actor_display_name(actor, truncate=250):
+    name = " ".join(actor.type_id.replace("_", ".").title().split(".")[1:])
+    return truncate_display_name(name, truncate)
+
+
+def classify_actor(type_id):
+    """Returns the category of an actor based on its type id"""
+    if "vehicle" in type_id:
+        return ACTOR_VEHICLE
+    elif "traffic_light" in type_id:
+        return ACTOR_TRAFFIC_LIGHT
+    elif "speed_limit" in type_id:
+        return ACTOR_SPEED_LIMIT
+    elif "walker.pedestrian" in type_id:
+        return ACTOR_WALKER
+    return ACTOR_OTHER
+
+
+class ActorInfo(object):
+    """Holds the information of an actor that does not change during its lifetime"""
+
+    def __init__(self, actor):
+        """Classifies the actor and reads its attributes once"""
+        self.actor = actor
+        self.id = actor.id
+        self.type_id = actor.type_id
+        self.category = classify_actor(self.type_id)
+        self.display_name = get_actor_display_name(actor)
+        self.is_hero = False
+        self.color = None
+        self.label_color = None
+        self.label = str(self.id)
+        self.extent = (0.0, 0.0, 0.0)
+        self.trigger_volume = None
+
+        # Largest distance from the location of the actor to any point it
+        # covers, used to find the actors that may reach a location
+        self.reach = 0.0
+
+        if self.category == ACTOR_VEHICLE:
+            bb = actor.bounding_box.extent
+            self.extent = (bb.x, bb.y, bb.z)
+            self.is_hero = actor.attributes.get("role_name") == "hero"
+            two_wheeled = int(actor.attributes.get("number_of_wheels", 4)) == 2
+            if self.is_hero:
+                self.color = COLOR_CHAMELEON_0
+                self.label_color = COLOR_CHAMELEON_0
+            elif two_wheeled:
+                self.color = COLOR_CHOCOLATE_1
+                self.label_color = COLOR_CHOCOLATE_0
+            else:
+                self.color = COLOR_SKY_BLUE_0
+                self.label_color = COLOR_SKY_BLUE_0
+
+        elif self.category == ACTOR_WALKER:
+            bb = actor.bounding_box.extent
+            self.extent = (bb.x, bb.y, bb.z)
+            self.color = COLOR_PLUM_0
+
+        elif self.category == ACTOR_TRAFFIC_LIGHT:
+            self.trigger_volume = actor.trigger_volume
+            tv = self.trigger_volume.extent
+            self.extent = (tv.x, tv.y, tv.z)
+            tl = self.trigger_volume.location
+            self.reach = math.sqrt(tl.x**2 + tl.y**2 + tl.z**2)
+
+        elif self.category == ACTOR_SPEED_LIMIT:
+            self.label = self.type_id.split(".")[2]
+
+        self.reach += math.sqrt(sum(x**2 for x in self.extent))
+
+
+class ActorRegistry(object):
+    """Caches the information of the actors in the world by actor id. Actors are classified the first time they are
+    seen and are evicted once they leave the world"""
+
+    def __init__(self):
+        self._infos = dict()
+
+    def __contains__(self, actor_id):
+        return actor_id in self._infos
+
+    def __len__(self):
+        return len(self._infos)
+
+    def __iter__(self):
+        return iter(list(self._infos.values()))
+
+    def get(self, actor_id):
+        """Returns the information of an actor, or None if it has not been registered"""
+        return self._infos.get(actor_id)
+
+    def register(self, actor):
+        """Returns the information of an actor, classifying it if it is seen for the first time"""
+        info = self._infos.get(actor.id)
+        if info is None:
+            info = ActorInfo(actor)
+            self._infos[actor.id] = info
+        return info
+
+    def retain(self, actor_ids):
+        """Evicts all the actors whose ids are not in the given set"""
+        for actor_id in [x for x in self._infos if x not in actor_ids]:
+            del self._infos[actor_id]
+
+    def clear(self):
+        """Forgets all the registered actors"""
+        self._infos = dict()
@@ -0,0 +1,99 @@
+import numpy as np
+
+# Outlines of the actors in their local frame, expressed as a factor of the
+# bounding box extent plus a fixed offset in meters
+VEHICLE_OUTLINE_SCALE = np.array(
+    [(-1, -1), (1, -1), (1, 0), (1, 1), (-1, 1), (-1, -1)], dtype=np.float64
+)
+VEHICLE_OUTLINE_OFFSET = np.array(
+    [(0, 0), (-0.8, 0), (0, 0), (-0.8, 0), (0, 0), (0, 0)], dtype=np.float64
+)
+WALKER_OUTLINE_SCALE = np.array([(-1, -1), (1, -1), (1, 1), (-1, 1)], dtype=np.float64)
+WALKER_OUTLINE_OFFSET = np.zeros((4, 2), dtype=np.float64)
+
+
+class ActorStateStore(object):
+    """Structure of arrays holding the state of every actor in the current tick. Row i of every array, and of the
+    infos and transforms lists, belongs to the same actor"""
+
+    def __init__(self):
+        self.infos = []
+        self.transforms = []
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.category = np.zeros(0, dtype=np.int8)
+        self.x = np.zeros(0, dtype=np.float64)
+        self.y = np.zeros(0, dtype=np.float64)
+        self.yaw = np.zeros(0, dtype=np.float64)
+        self.vx = np.zeros(0, dtype=np.float64)
+        self.vy = np.zeros(0, dtype=np.float64)
+        self.extent_x = np.zeros(0, dtype=np.float64)
+        self.extent_y = np.zeros(0, dtype=np.float64)
+        self.reach = np.zeros(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.infos)
+
+    def update(self, infos, transforms, velocities=None):
+        """Fills the arrays with the actors of the current tick. Velocities is an optional dictionary from actor id
+        to velocity, actors without an entry are considered to be static"""
+        n = len(infos)
+        self.infos = infos
+        self.transforms = transforms
+
+        self.ids = np.fromiter((info.id for info in infos), dtype=np.int64, count=n)
+        self.category = np.fromiter(
+            (info.category for info in infos), dtype=np.int8, count=n
+        )
+        extents = np.array(
+            [info.extent[:2] + (info.reach,) for info in infos], dtype=np.float64
+        )
+        poses = np.array(
+            [(t.location.x, t.location.y, t.rotation.yaw) for t in transforms],
+            dtype=np.float64,
+        )
+        extents = extents.reshape(n, 3)
+        poses = poses.reshape(n, 3)
+        self.extent_x = extents[:, 0]
+        self.extent_y = extents[:, 1]
+        self.reach = extents[:, 2]
+        self.x = poses[:, 0]
+        self.y = poses[:, 1]
+        self.yaw = poses[:, 2]
+
+        self.vx = np.zeros(n, dtype=np.float64)
+        self.vy = np.zeros(n, dtype=np.float64)
+        if velocities:
+            for i, info in enumerate(infos):
+                v = velocities.get(info.id)
+                if v is not None:
+                    self.vx[i] = v.x
+                    self.vy[i] = v.y
+
+    def select(self, category):
+        """Returns the row indices of the actors of a category"""
+        return np.flatnonzero(self.category == category)
+
+    def locations(self, indices):
+        """Returns the (N, 2) world locations of the given rows"""
+        return np.stack((self.x[indices], self.y[indices]), axis=-1)
+
+    def outlines(self, indices, outline_scale, outline_offset):
+        """Returns the (N, K, 2) world coordinates of an outline of K points placed on every given actor"""
+        ext = np.stack((self.extent_x[indices], self.extent_y[indices]), axis=-1)
+        local = ext[:, None, :] * outline_scale[None, :, :] + outline_offset[None, :, :]
+
+        yaw = np.radians(self.yaw[indices])
+        c = np.cos(yaw)[:, None]
+        s = np.sin(yaw)[:, None]
+        world = np.empty_like(local)
+        world[..., 0] = local[..., 0] * c - local[..., 1] * s + self.x[indices, None]
+        world[..., 1] = local[..., 0] * s + local[..., 1] * c + self.y[indices, None]
+        return world
+
+    def vehicle_corners(self, indices):
+        """Returns the (N, 6, 2) world coordinates of the arrow shaped outline of the given vehicles"""
+        return self.outlines(indices, VEHICLE_OUTLINE_SCALE, VEHICLE_OUTLINE_OFFSET)
+
+    def walker_corners(self, indices):
+        """Returns the (N, 4, 2) world coordinates of the bounding boxes of the given walkers"""
+        return self.outlines(indices, WALKER_OUTLINE_SCALE, WALKER_OUTLINE_OFFSET)
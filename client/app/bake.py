@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import logging
+import argparse
+
+import carla
+import pygame
+
+from .world import MapImage, PIXELS_PER_METER, MAP_CACHE_DIR, MAP_MAX_PIXEL_ERROR
+
+
+def generate_opendrive_world(client, xodr_path):
+    """Loads a new world with a minimum physical road representation of an OpenDRIVE file"""
+    with open(xodr_path, encoding="utf-8") as od_file:
+        data = od_file.read()
+    return client.generate_opendrive_world(
+        data,
+        carla.OpendriveGenerationParameters(
+            vertex_distance=2.0,
+            max_road_length=500.0,
+            wall_height=1.0,
+            additional_width=0.6,
+            smooth_junctions=True,
+            enable_mesh_visibility=True,
+        ),
+    )
+
+
+def bake_world(world, args):
+    """Renders the map of a world into the cache, unless an up to date cache already exists"""
+    carla_map = world.get_map()
+    start = time.time()
+    map_image = MapImage(
+        carla_world=world,
+        carla_map=carla_map,
+        pixels_per_meter=PIXELS_PER_METER,
+        show_triggers=args.show_triggers,
+        show_connections=args.show_connections,
+        show_spawn_points=args.show_spawn_points,
+        cache_dir=args.cache_dir,
+        workers=args.jobs,
+        max_pixel_error=args.max_pixel_error,
+    )
+    map_image.close()
+    print("%-40s %8.1f s" % (carla_map.name, time.time() - start))
+
+
+def bake(args):
+    """Connects to the server once and bakes the requested maps"""
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(args.timeout)
+
+    if args.xodr_path is not None:
+        if not os.path.isfile(args.xodr_path):
+            logging.error("file %s not found", args.xodr_path)
+            sys.exit(1)
+        bake_world(generate_opendrive_world(client, args.xodr_path), args)
+        return
+
+    maps = args.map if args.map else sorted(client.get_available_maps())
+    for map_name in maps:
+        try:
+            bake_world(client.load_world(map_name), args)
+        except RuntimeError as ex:
+            logging.error("could not bake %s: %s", map_name, ex)
+
+
+def main():
+    """Parses the arguments received from commandline and bakes the map caches"""
+    argparser = argparse.ArgumentParser(
+        description="Pre-renders the map caches of the 2D visualizer, so that the client starts without rendering the map"
+    )
+    argparser.add_argument(
+        "--host",
+        metavar="H",
+        default="127.0.0.1",
+        help="IP of the host server (default: 127.0.0.1)",
+    )
+    argparser.add_argument(
+        "-p",
+        "--port",
+        metavar="P",
+        default=2000,
+        type=int,
+        help="TCP port to listen to (default: 2000)",
+    )
+    argparser.add_argument(
+        "--timeout",
+        metavar="X",
+        default=60.0,
+        type=float,
+        help="Timeout duration, loading a map may take a while (default: 60.0s)",
+    )
+    argparser.add_argument(
+        "-m",
+        "--map",
+        action="append",
+        help="map to bake, may be repeated (default: all the available maps)",
+    )
+    argparser.add_argument(
+        "-x",
+        "--xodr-path",
+        metavar="XODR_FILE_PATH",
+        help="bake a map generated from the provided OpenDRIVE file",
+    )
+    argparser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        default=MAP_CACHE_DIR,
+        help="directory of the map caches (default: %s)" % MAP_CACHE_DIR,
+    )
+    argparser.add_argument(
+        "--max-pixel-error",
+        metavar="PX",
+        default=MAP_MAX_PIXEL_ERROR,
+        type=float,
+        help="largest deviation of the drawn roads from the map, 0 samples roads every 5 cm (default: %s)"
+        % MAP_MAX_PIXEL_ERROR,
+    )
+    argparser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=None,
+        help="number of processes rasterizing the map tiles (default: one per core)",
+    )
+    argparser.add_argument(
+        "--show-triggers",
+        action="store_true",
+        help="draw the trigger volumes of stops and yields",
+    )
+    argparser.add_argument(
+        "--show-connections",
+        action="store_true",
+        help="draw the connections between waypoints",
+    )
+    argparser.add_argument(
+        "--show-spawn-points",
+        action="store_true",
+        help="draw the spawn points",
+    )
+
+    # Parse arguments
+    args = argparser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+    # Fonts are needed to draw the traffic signs, no window is opened
+    pygame.init()
+    try:
+        bake(args)
+    except KeyboardInterrupt:
+        print("\nCancelled by user. Bye!")
+    finally:
+        pygame.quit()
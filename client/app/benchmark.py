@@ -0,0 +1,483 @@
+import os
+import sys
+import glob
+import json
+import math
+import time
+import argparse
+import tracemalloc
+import collections
+
+import numpy as np
+
+from .controller import (
+    circle_line_segment_intersection,
+    get_target_point,
+    get_target_point_reference,
+    PurePursuitController,
+    BatchPurePursuitController,
+)
+from .route import Route
+
+# Step of the recorded trajectories, the fixed_delta_seconds of the client
+BENCHMARK_DT = 0.04
+BENCHMARK_TARGET_SPEED = 10.0  # meters per second
+BENCHMARK_STEPS = 500
+
+# Percentiles of the latency of each call that are reported
+BENCHMARK_PERCENTILES = (50, 95, 99)
+
+# Largest distance, in meters, between the target points of get_target_point
+# and get_target_point_reference for them to be considered the same
+BENCHMARK_MATCH_TOLERANCE = 1e-6
+
+# Largest number of calls timed per trajectory for the segment intersection
+# and for the loop target point, the steps are sampled evenly
+BENCHMARK_MAX_SEGMENT_CALLS = 20000
+BENCHMARK_MAX_REFERENCE_CALLS = 100
+
+# Number of vehicles driven by the batched controller
+BENCHMARK_FLEET_SIZE = 32
+
+# Recorded trajectories replayed by default. They are fixed inputs, so that
+# results of different versions of the controllers can be compared
+BENCHMARK_TRAJECTORY_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "trajectories"
+)
+
+# Largest increase of the median latency of a benchmark over the baseline
+# before the run fails, as a fraction of the baseline
+BENCHMARK_MAX_REGRESSION = 0.3
+
+# Vehicle model used to record the built in trajectories
+RECORD_WHEEL_BASE = 2.65
+RECORD_MAX_STEER_ANGLE = 0.7  # radians, at steer 1.0
+RECORD_MAX_ACCELERATION = 3.0  # meters per second squared, at throttle 1.0
+
+# Route of hero_with_controller
+HERO_WAYPOINTS = [
+    (-74.6, 24.5),
+    (-54.6, 24.5),
+    (-47.6, 21.5),
+    (-41.6, 10.5),
+    (-41.6, -40.5),
+]
+
+Vector3D = collections.namedtuple("Vector3D", ("x", "y", "z"))
+Rotation = collections.namedtuple("Rotation", ("pitch", "yaw", "roll"))
+Transform = collections.namedtuple("Transform", ("location", "rotation"))
+
+
+class StubActor(object):
+    """Stands for a carla.Vehicle in the controllers, its pose (x, y, yaw in degrees) and velocity are set by the
+    caller"""
+
+    def __init__(self, pose=(0.0, 0.0, 0.0), velocity=(0.0, 0.0, 0.0)):
+        self.pose = pose
+        self.velocity = velocity
+
+    def get_transform(self):
+        x, y, yaw = self.pose
+        return Transform(Vector3D(x, y, 0.0), Rotation(0.0, yaw, 0.0))
+
+    def get_velocity(self):
+        return Vector3D(*self.velocity)
+
+
+class Trajectory(object):
+    """Recorded poses (x, y, yaw in degrees) and velocities of a vehicle that follows a list of waypoints, one row
+    per tick. Stored as an npz file with the same array names, so recordings of live runs can be replayed too"""
+
+    def __init__(self, name, poses, velocities, waypoints, dt, target_speed):
+        self.name = name
+        self.poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+        self.velocities = np.asarray(velocities, dtype=np.float64).reshape(-1, 3)
+        self.waypoints = np.asarray(waypoints, dtype=np.float64).reshape(-1, 2)
+        self.dt = dt
+        self.target_speed = target_speed
+
+    def __len__(self):
+        return len(self.poses)
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            poses=self.poses,
+            velocities=self.velocities,
+            waypoints=self.waypoints,
+            dt=self.dt,
+            target_speed=self.target_speed,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                os.path.splitext(os.path.basename(path))[0],
+                data["poses"],
+                data["velocities"],
+                data["waypoints"],
+                float(data["dt"]),
+                float(data["target_speed"]),
+            )
+
+    @classmethod
+    def record(cls, name, waypoints, start, steps=BENCHMARK_STEPS, dt=BENCHMARK_DT):
+        """Records a vehicle driven along the waypoints by PurePursuitController from a start pose, with a
+        kinematic bicycle model. Recording stops when the controller finds no target point"""
+        x, y, yaw = start
+        speed = 0.0
+        actor = StubActor()
+        controller = PurePursuitController()
+        poses = []
+        velocities = []
+        for _ in range(steps):
+            theta = math.radians(yaw)
+            velocity = (speed * math.cos(theta), speed * math.sin(theta), 0.0)
+            poses.append((x, y, yaw))
+            velocities.append(velocity)
+
+            actor.pose = poses[-1]
+            actor.velocity = velocity
+            try:
+                throttle, steer = controller.get_control(
+                    actor, waypoints, BENCHMARK_TARGET_SPEED, dt
+                )
+            except RuntimeError:
+                break
+
+            angle = np.clip(steer, -1.0, 1.0) * RECORD_MAX_STEER_ANGLE
+            speed = max(
+                0.0, speed + np.clip(throttle, -1.0, 1.0) * RECORD_MAX_ACCELERATION * dt
+            )
+            x += velocity[0] * dt
+            y += velocity[1] * dt
+            yaw += math.degrees(speed * math.tan(angle) / RECORD_WHEEL_BASE * dt)
+
+        return cls(name, poses, velocities, waypoints, dt, BENCHMARK_TARGET_SPEED)
+
+
+def builtin_trajectories():
+    """Records the route of hero_with_controller and a dense route of a kilometer sampled every half meter. The
+    recordings depend on the current controllers, the benchmark replays the ones saved in
+    BENCHMARK_TRAJECTORY_DIR"""
+    s = np.arange(0.0, 1000.0, 0.5)
+    dense = np.stack((s, 40.0 * np.sin(s / 150.0)), axis=-1)
+    return [
+        Trajectory.record("hero", HERO_WAYPOINTS, (-114.6, 24.5, 0.0)),
+        Trajectory.record("dense", dense, (0.0, 0.0, math.degrees(40.0 / 150.0))),
+    ]
+
+
+def recorded_trajectories(dirname=BENCHMARK_TRAJECTORY_DIR):
+    """Loads the trajectories saved in a directory, sorted by name"""
+    return [
+        Trajectory.load(path) for path in sorted(glob.glob(os.path.join(dirname, "*.npz")))
+    ]
+
+
+def relative_polylines(trajectory):
+    """Returns, for every step, the lookahead distance and the waypoints ahead of the vehicle in its frame, as
+    PurePursuitController gives them to get_target_point"""
+    cases = []
+    for (x, y, yaw), velocity in zip(trajectory.poses, trajectory.velocities):
+        theta = math.radians(yaw)
+        c, s = math.cos(theta), math.sin(theta)
+        points = np.matmul(trajectory.waypoints - (x, y), ((c, -s), (s, c)))
+        polyline = np.vstack(((0.0, 0.0), points[points[:, 0] > 0]))
+        lookahead = float(np.clip(0.4 * math.hypot(*velocity), 8, 20))
+        cases.append((lookahead, polyline))
+    return cases
+
+
+def measure(name, make_calls, alloc=True):
+    """Times every call of a list and returns the latency percentiles in microseconds. With alloc, a second list
+    of calls is run under tracemalloc to measure the peak memory each call allocates. make_calls returns a new
+    list of calls for each pass, calls that keep state such as controllers must not be shared between passes"""
+    calls = make_calls()
+    latencies = np.empty(len(calls))
+    for i, call in enumerate(calls):
+        start = time.perf_counter_ns()
+        call()
+        latencies[i] = time.perf_counter_ns() - start
+    latencies *= 1e-3
+
+    result = collections.OrderedDict(name=name, calls=len(calls))
+    for p, value in zip(
+        BENCHMARK_PERCENTILES, np.percentile(latencies, BENCHMARK_PERCENTILES)
+    ):
+        result["p%d_us" % p] = value
+    result["max_us"] = latencies.max()
+
+    if alloc:
+        calls = make_calls()
+        peaks = np.empty(len(calls))
+        tracemalloc.start()
+        try:
+            for i, call in enumerate(calls):
+                tracemalloc.reset_peak()
+                current = tracemalloc.get_traced_memory()[0]
+                call()
+                peaks[i] = tracemalloc.get_traced_memory()[1] - current
+        finally:
+            tracemalloc.stop()
+        result["alloc_mean_bytes"] = peaks.mean()
+        result["alloc_max_bytes"] = peaks.max()
+    return result
+
+
+def _sample(items, count):
+    """Returns at most count items evenly spread over a list"""
+    if len(items) <= count:
+        return items
+    return [items[i] for i in np.linspace(0, len(items) - 1, count).astype(int)]
+
+
+def _intersection_calls(cases):
+    """Returns one call per segment of the polylines"""
+    segments = [
+        (lookahead, polyline[j], polyline[j + 1])
+        for lookahead, polyline in cases
+        for j in range(len(polyline) - 1)
+    ]
+    segments = _sample(segments, BENCHMARK_MAX_SEGMENT_CALLS)
+    return [
+        lambda lookahead=lookahead, pt1=pt1, pt2=pt2: circle_line_segment_intersection(
+            (0, 0), lookahead, pt1, pt2, full_line=False
+        )
+        for lookahead, pt1, pt2 in segments
+    ]
+
+
+def _target_point_calls(cases, function, as_list=False):
+    """Returns one call of a target point function per step"""
+    return [
+        lambda lookahead=lookahead, polyline=(
+            list(polyline) if as_list else polyline
+        ): function(lookahead, polyline)
+        for lookahead, polyline in cases
+    ]
+
+
+def _controller_calls(trajectory, use_route):
+    """Returns one call per step that moves the stub actor to the step and runs the controller on it. The actor
+    and the controller are created once and reused by every step, as the hero keeps its controller. Steps without a
+    target point ahead raise RuntimeError in the controller and are timed too"""
+    actor = StubActor()
+    controller = PurePursuitController()
+    waypoints = Route(trajectory.waypoints) if use_route else trajectory.waypoints
+    steps = iter(zip(trajectory.poses.tolist(), trajectory.velocities.tolist()))
+
+    def call():
+        actor.pose, actor.velocity = next(steps)
+        try:
+            controller.get_control(
+                actor, waypoints, trajectory.target_speed, trajectory.dt
+            )
+        except RuntimeError:
+            pass
+
+    return [call] * len(trajectory)
+
+
+def _fleet_calls(trajectory, n):
+    """Returns one call per step that runs a batched controller, created once and reused by every step, on n
+    copies of the trajectory"""
+    controller = BatchPurePursuitController([trajectory.waypoints] * n)
+    steps = iter(zip(trajectory.poses.tolist(), trajectory.velocities.tolist()))
+
+    def call():
+        (x, y, yaw), velocity = next(steps)
+        controller.get_control(
+            np.full(n, x),
+            np.full(n, y),
+            np.full(n, yaw),
+            np.full(n, math.hypot(*velocity)),
+            trajectory.target_speed,
+            trajectory.dt,
+        )
+
+    return [call] * len(trajectory)
+
+
+def check_target_points(cases):
+    """Returns the number of steps where get_target_point and get_target_point_reference disagree"""
+    mismatches = 0
+    for lookahead, polyline in cases:
+        # The reference divides by zero on zero length segments of the rows
+        with np.errstate(divide="ignore", invalid="ignore"):
+            expected = get_target_point_reference(lookahead, list(polyline))
+        found = get_target_point(lookahead, polyline)
+        if (expected is None) != (found is None) or (
+            expected is not None
+            and math.hypot(expected[0] - found[0], expected[1] - found[1])
+            > BENCHMARK_MATCH_TOLERANCE
+        ):
+            mismatches += 1
+    return mismatches
+
+
+def run_benchmarks(trajectories, alloc=True, fleet_size=BENCHMARK_FLEET_SIZE):
+    """Benchmarks the controller stack on every trajectory and returns the results and the number of steps where
+    the target points disagree"""
+    results = []
+    mismatches = 0
+    for trajectory in trajectories:
+        cases = relative_polylines(trajectory)
+        mismatches += check_target_points(cases)
+
+        segment_calls = _intersection_calls(cases)
+        reference_calls = _target_point_calls(
+            _sample(cases, BENCHMARK_MAX_REFERENCE_CALLS), get_target_point_reference, True
+        )
+        target_calls = _target_point_calls(cases, get_target_point)
+        benchmarks = (
+            ("circle_line_segment_intersection", lambda: segment_calls),
+            ("get_target_point_reference", lambda: reference_calls),
+            ("get_target_point", lambda: target_calls),
+            ("PurePursuitController", lambda: _controller_calls(trajectory, False)),
+            ("PurePursuitController+Route", lambda: _controller_calls(trajectory, True)),
+            (
+                "BatchPurePursuitController/%d" % fleet_size,
+                lambda: _fleet_calls(trajectory, fleet_size),
+            ),
+        )
+        for name, make_calls in benchmarks:
+            result = measure(name, make_calls, alloc)
+            result["trajectory"] = trajectory.name
+            results.append(result)
+    return results, mismatches
+
+
+def compare_results(results, baseline, max_regression=BENCHMARK_MAX_REGRESSION):
+    """Returns the results whose median latency is more than max_regression above the one of the same benchmark
+    and trajectory in the baseline results, with their baseline median. Benchmarks missing from the baseline are
+    not compared"""
+    baseline_p50 = {
+        (result["trajectory"], result["name"]): result["p50_us"] for result in baseline
+    }
+    regressions = []
+    for result in results:
+        expected = baseline_p50.get((result["trajectory"], result["name"]))
+        if expected is not None and result["p50_us"] > expected * (1.0 + max_regression):
+            regressions.append((result, expected))
+    return regressions
+
+
+def print_results(results):
+    columns = ["p%d_us" % p for p in BENCHMARK_PERCENTILES] + ["max_us"]
+    print(
+        "%-10s %-36s %8s"
+        % ("trajectory", "benchmark", "calls")
+        + "".join("%10s" % column for column in columns)
+        + "%12s" % "alloc_bytes"
+    )
+    for result in results:
+        print(
+            "%-10s %-36s %8d"
+            % (result["trajectory"][-10:], result["name"], result["calls"])
+            + "".join("%10.1f" % result[column] for column in columns)
+            + (
+                "%12d" % result["alloc_mean_bytes"]
+                if "alloc_mean_bytes" in result
+                else "%12s" % "-"
+            )
+        )
+
+
+def main():
+    """Parses the arguments received from commandline and runs the controller benchmarks"""
+    argparser = argparse.ArgumentParser(
+        description="Replays recorded trajectories through the controllers and reports the latency and the allocations of each call, no server is needed"
+    )
+    argparser.add_argument(
+        "-t",
+        "--trajectory",
+        metavar="FILE",
+        action="append",
+        help="recorded trajectory to replay, may be repeated (default: the trajectories in %s)"
+        % BENCHMARK_TRAJECTORY_DIR,
+    )
+    argparser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="record the built in trajectories with the current controllers, save them as npz files in DIR and replay them",
+    )
+    argparser.add_argument(
+        "--fleet-size",
+        metavar="N",
+        default=BENCHMARK_FLEET_SIZE,
+        type=int,
+        help="number of vehicles of the batched controller (default: %d)"
+        % BENCHMARK_FLEET_SIZE,
+    )
+    argparser.add_argument(
+        "--no-alloc",
+        action="store_true",
+        help="do not measure the allocations, which doubles the run time",
+    )
+    argparser.add_argument(
+        "--json",
+        metavar="FILE",
+        help="write the results to FILE as JSON",
+    )
+    argparser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="JSON results of a previous run, fail if a median latency regressed by more than --max-regression",
+    )
+    argparser.add_argument(
+        "--max-regression",
+        metavar="F",
+        default=BENCHMARK_MAX_REGRESSION,
+        type=float,
+        help="largest increase of a median latency over the baseline, as a fraction (default: %s)"
+        % BENCHMARK_MAX_REGRESSION,
+    )
+
+    # Parse arguments
+    args = argparser.parse_args()
+
+    if args.trajectory:
+        trajectories = [Trajectory.load(path) for path in args.trajectory]
+    elif args.record:
+        trajectories = builtin_trajectories()
+        if not os.path.isdir(args.record):
+            os.makedirs(args.record)
+        for trajectory in trajectories:
+            trajectory.save(os.path.join(args.record, trajectory.name + ".npz"))
+    else:
+        trajectories = recorded_trajectories()
+        if not trajectories:
+            print(
+                "no recorded trajectories in %s, record them with --record"
+                % BENCHMARK_TRAJECTORY_DIR
+            )
+            sys.exit(1)
+
+    results, mismatches = run_benchmarks(
+        trajectories, alloc=not args.no_alloc, fleet_size=args.fleet_size
+    )
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "mismatches": mismatches}, f, indent=1)
+
+    # Fail when the vectorized target point differs or the latency regressed,
+    # so that regressions show up in CI
+    failed = False
+    if mismatches:
+        print("get_target_point differs from the reference in %d steps" % mismatches)
+        failed = True
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        for result, expected in compare_results(results, baseline, args.max_regression):
+            print(
+                "%s %s: p50 %.1f us, baseline %.1f us"
+                % (result["trajectory"], result["name"], result["p50_us"], expected)
+            )
+            failed = True
+    if failed:
+        sys.exit(1)
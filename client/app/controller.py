@@ -2,6 +2,12 @@
 import math
 import numpy as np
 
+from .route import Route, RouteBatch
+
+# Polylines of up to this many points are intersected one segment at a time,
+# which is faster than the array operations for short polylines
+TARGET_POINT_LOOP_SIZE = 12
+
 # Function from https://stackoverflow.com/a/59582674/2609987
 def circle_line_segment_intersection(
     circle_center, circle_radius, pt1, pt2, full_line=True, tangent_tol=1e-9
@@ -56,8 +62,106 @@ def circle_line_segment_intersection(
             return intersections
 
 
-def get_target_point(lookahead, polyline):
-    """Determines the target point for the pure pursuit controller
+def circle_segments_intersection(radius, x1, y1, x2, y2, tangent_tol=1e-9):
+    """Intersects circles centered at the origin with line segments, all at once. Radius is a scalar or one radius
+    per segment. Uses the formulas and the order of operations of circle_line_segment_intersection with
+    full_line=False
+
+    Returns the indices of the segments whose line crosses their circle, the (K,2) x and y coordinates of both
+    intersections of these segments in the order along the segment, and a (K,2) mask of the intersections that
+    are within the segment. Only the first intersection of a tangent segment is kept
+    """
+    dx, dy = (x2 - x1), (y2 - y1)
+    dr = (dx**2 + dy**2) ** 0.5
+    big_d = x1 * y2 - x2 * y1
+    discriminant = radius**2 * dr**2 - big_d**2
+
+    # Only the segments whose line crosses the circle can intersect it
+    rows = np.flatnonzero(discriminant >= 0)
+    x1, y1, dx, dy, dr, big_d, discriminant = (
+        array[rows] for array in (x1, y1, dx, dy, dr, big_d, discriminant)
+    )
+
+    # Zero length segments divide by zero, so none of their intersections is
+    # kept below
+    order = np.array((-1.0, 1.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        root = discriminant**0.5
+        sign = np.where(dy < 0, -1.0, 1.0)
+        xi = ((big_d * dy)[:, None] + order * (dx * root)[:, None]) / (dr**2)[:, None]
+        yi = (
+            (-big_d * dx)[:, None] + order * (sign * np.abs(dy) * root)[:, None]
+        ) / (dr**2)[:, None]
+        fraction = np.where(
+            (np.abs(dx) > np.abs(dy))[:, None],
+            (xi - x1[:, None]) / dx[:, None],
+            (yi - y1[:, None]) / dy[:, None],
+        )
+
+    inside = (fraction >= 0) & (fraction <= 1)
+    inside[:, 1] &= ~(inside[:, 0] & (np.abs(discriminant) <= tangent_tol))
+    return rows, xi, yi, inside
+
+
+def get_target_point(lookahead, polyline, tangent_tol=1e-9):
+    """Determines the target point for the pure pursuit controller. Intersects the circle with every segment of
+    the polyline at once, it picks the same intersection as get_target_point_reference, up to the rounding of
+    the square roots. Short polylines are given to get_target_point_reference
+
+    Parameters
+    ----------
+    lookahead : float
+        The target point is on a circle of radius `lookahead`
+        The circle's center is (0,0)
+    poyline: array_like, shape (M,2)
+        A list of 2d points that defines a polyline.
+
+    Returns:
+    --------
+    target_point: tuple of two floats
+        Point with positive x-coordinate where the circle of radius `lookahead`
+        and the polyline intersect.
+        Return None if there is no such point.
+        If there are multiple such points, return the one that the polyline
+        visits first.
+    """
+    points = np.asarray(polyline, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return None
+    if len(points) <= TARGET_POINT_LOOP_SIZE:
+        return _get_target_point_loop(lookahead, points.tolist(), tangent_tol)
+
+    _, xi, yi, inside = circle_segments_intersection(
+        lookahead,
+        points[:-1, 0],
+        points[:-1, 1],
+        points[1:, 0],
+        points[1:, 1],
+        tangent_tol,
+    )
+    found = np.flatnonzero((inside & (xi > 0)).ravel())
+    if len(found) == 0:
+        return None
+    return (xi.ravel()[found[0]], yi.ravel()[found[0]])
+
+
+def _get_target_point_loop(lookahead, points, tangent_tol):
+    """get_target_point_reference on a list of points, which stops at the first target point. Zero length segments
+    are skipped, as they divide by zero and none of their intersections is kept"""
+    for pt1, pt2 in zip(points[:-1], points[1:]):
+        if pt1 == pt2:
+            continue
+        for point in circle_line_segment_intersection(
+            (0, 0), lookahead, pt1, pt2, full_line=False, tangent_tol=tangent_tol
+        ):
+            if point[0] > 0:
+                return point
+    return None
+
+
+def get_target_point_reference(lookahead, polyline, tangent_tol=1e-9):
+    """Determines the target point for the pure pursuit controller, one segment at a time. Kept as the reference
+    get_target_point is checked against
 
     Parameters
     ----------
@@ -81,7 +185,7 @@ def get_target_point(lookahead, polyline):
         pt1 = polyline[j]
         pt2 = polyline[j + 1]
         intersections += circle_line_segment_intersection(
-            (0, 0), lookahead, pt1, pt2, full_line=False
+            (0, 0), lookahead, pt1, pt2, full_line=False, tangent_tol=tangent_tol
         )
     filtered = [p for p in intersections if p[0] > 0]
     if len(filtered) == 0:
@@ -143,27 +247,155 @@ class PurePursuitController:
         else:
             self.pid = pid
 
-    def get_control(self, actor, waypoints, target_speed, dt):
+    @staticmethod
+    def get_waypoint_array(waypoints):
+        """Returns the waypoints as an (N,2) array of x and y. Waypoints may be locations or pairs of coordinates.
+        An (N,2) float array is used as is, lists are converted on every call, so changes made to them in place are
+        always followed. Long routes are best given as a Route or an array"""
+        if len(waypoints) > 0 and hasattr(waypoints[0], "x"):
+            waypoints = [(wp.x, wp.y) for wp in waypoints]
+        return np.asarray(waypoints, dtype=np.float64).reshape(-1, 2)
 
-        p = actor.get_transform().location
-        r = actor.get_transform().rotation
+    def get_control(self, actor, waypoints, target_speed, dt):
+        """Returns the acceleration and steer that follow the waypoints at the target speed. Waypoints may be a
+        Route, then only the window ahead of the vehicle is considered"""
+        transform = actor.get_transform()
+        p = transform.location
+        r = transform.rotation
         v = actor.get_velocity()
         current_speed = math.hypot(v.x, v.y, v.z)  # meters per second
 
         # We will make calculations wrt actor frame
-        theta = np.radians(r.yaw)
-        c, s = np.cos(theta), np.sin(theta)
+        theta = math.radians(r.yaw)
+        c, s = math.cos(theta), math.sin(theta)
         R = np.array(((c, -s), (s, c)))  # Rotation matrix
 
-        # Translate absolute waypoints to actor's frame  filter
+        if isinstance(waypoints, Route):
+            waypoints.update(p.x, p.y)
+            points = waypoints.window()
+        else:
+            points = self.get_waypoint_array(waypoints)
+
+        # Translate absolute waypoints to actor's frame
         # And discard waypoints behind the actor
-        relative_points = [np.array([0, 0])]
-        for wp in waypoints:
-            point = np.matmul(np.array([wp.x - p.x, wp.y - p.y]), R)
-            if point[0] > 0:
-                relative_points.append(point)
+        points = np.matmul(points - (p.x, p.y), R)
+        relative_points = np.vstack(((0.0, 0.0), points[points[:, 0] > 0]))
 
         accel = self.pid.get_control(target_speed, current_speed, dt)
         steer = self.pure_pursuit.get_control(relative_points, current_speed)
 
         return accel, steer
+
+
+class BatchPIDController:
+    """PIDController of N vehicles, the state of each one is a row of the arrays"""
+
+    def __init__(self, n, Kp, Ki, Kd):
+        self.Kp = Kp
+        self.Ki = Ki
+        self.Kd = Kd
+        self.int_term = np.zeros(n)
+        self.derivative_term = np.zeros(n)
+        self.last_error = np.full(n, np.nan)
+
+    def keep(self, indices):
+        """Keeps the state of some of the vehicles only"""
+        self.int_term = self.int_term[indices]
+        self.derivative_term = self.derivative_term[indices]
+        self.last_error = self.last_error[indices]
+
+    def get_control(self, target, measurement, dt, indices=None):
+        """Returns the controls of the given vehicles, all of them by default, the other states are left as is"""
+        if indices is None:
+            indices = np.arange(len(self.int_term))
+        error = target - np.asarray(measurement, dtype=np.float64)
+        self.int_term[indices] += error * self.Ki * dt
+        last_error = self.last_error[indices]
+        derivative_term = self.derivative_term[indices]
+        known = ~np.isnan(last_error)
+        derivative_term[known] = (error - last_error)[known] / dt * self.Kd
+        self.derivative_term[indices] = derivative_term
+        self.last_error[indices] = error
+        return self.Kp * error + self.int_term[indices] + derivative_term
+
+
+class BatchPurePursuitController:
+    """PurePursuitController of N vehicles following their own route. The routes, cursors and PID states are
+    kept in arrays and the controls of all the vehicles are computed with one set of array operations. Vehicles
+    without a target point ahead are flagged in lost and get no steer"""
+
+    def __init__(self, routes, K_dd=0.4, wheel_base=2.65, pid=None):
+        self.routes = routes if isinstance(routes, RouteBatch) else RouteBatch(routes)
+        self.K_dd = K_dd
+        self.wheel_base = wheel_base
+        if pid is None:
+            self.pid = BatchPIDController(len(self.routes), Kp=0.20, Ki=0.01, Kd=0)
+        else:
+            self.pid = pid
+        self.lost = np.zeros(len(self.routes), dtype=bool)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def keep(self, indices):
+        """Keeps the routes and PID states of some of the vehicles only, in the given order"""
+        self.routes = self.routes.select(indices)
+        self.pid.keep(indices)
+        self.lost = self.lost[indices]
+
+    def get_control(self, x, y, yaw, speed, target_speed, dt, indices=None):
+        """Returns the acceleration and steer of every vehicle from arrays of their location, yaw in degrees and
+        speed in meters per second. If indices is given, the arrays belong to those vehicles only and the routes and
+        PID states of the others are left as is"""
+        if indices is None:
+            indices = np.arange(len(self.routes))
+        n = len(indices)
+        x, y, yaw, speed = (
+            np.asarray(array, dtype=np.float64) for array in (x, y, yaw, speed)
+        )
+        self.routes.update(x, y, indices)
+
+        # Window points in the frame of their vehicle, without the ones behind
+        owner, index = self.routes.window(indices)
+        theta = np.radians(yaw)
+        c, s = np.cos(theta)[owner], np.sin(theta)[owner]
+        dx = self.routes.points[index, 0] - x[owner]
+        dy = self.routes.points[index, 1] - y[owner]
+        px = dx * c + dy * s
+        py = dy * c - dx * s
+        ahead = px > 0
+
+        # Polyline of every vehicle starts at its origin
+        owner = np.concatenate((np.arange(n), owner[ahead]))
+        order = np.argsort(owner, kind="stable")
+        owner = owner[order]
+        px = np.concatenate((np.zeros(n), px[ahead]))[order]
+        py = np.concatenate((np.zeros(n), py[ahead]))[order]
+
+        # First forward intersection of the lookahead circle with the
+        # polyline of every vehicle
+        look_ahead_distance = np.clip(self.K_dd * speed, 8, 20)
+        segments = np.flatnonzero(owner[1:] == owner[:-1])
+        rows, xi, yi, inside = circle_segments_intersection(
+            look_ahead_distance[owner[segments]],
+            px[segments],
+            py[segments],
+            px[segments + 1],
+            py[segments + 1],
+        )
+        hits = np.flatnonzero((inside & (xi > 0)).ravel())
+        hit_owner = owner[segments[rows]].repeat(2)[hits]
+        vehicles, first = np.unique(hit_owner, return_index=True)
+        target_x = np.zeros(n)
+        target_y = np.zeros(n)
+        target_x[vehicles] = xi.ravel()[hits[first]]
+        target_y[vehicles] = yi.ravel()[hits[first]]
+        lost = np.ones(n, dtype=bool)
+        lost[vehicles] = False
+        self.lost[indices] = lost
+
+        alpha = np.arctan2(target_y, target_x)
+        steer = np.arctan((2 * self.wheel_base * np.sin(alpha)) / look_ahead_distance)
+
+        accel = self.pid.get_control(target_speed, speed, dt, indices)
+        return accel, steer
@@ -0,0 +1,153 @@
+import random
+import logging
+
+import carla
+import numpy as np
+
+from .controller import BatchPurePursuitController
+
+# Routes of the vehicles spawned by the client, they follow the lanes ahead
+# of their spawn point for this many meters, with a waypoint every spacing
+FLEET_ROUTE_LENGTH = 300.0
+FLEET_ROUTE_SPACING = 2.0
+FLEET_TARGET_SPEED = 8.0  # meters per second
+
+# Ticks a spawned vehicle may be missing from the frames before it is
+# considered gone, spawned vehicles only show up in a later frame
+FLEET_MAX_UNSEEN_TICKS = 20
+
+
+def apply_vehicle_controls(client, actor_ids, throttle, steer):
+    """Sends the controls of several vehicles in a single batch of commands instead of one apply_control request
+    per vehicle"""
+    commands = [
+        carla.command.ApplyVehicleControl(
+            int(actor_id), carla.VehicleControl(throttle=float(t), steer=float(s))
+        )
+        for actor_id, t, s in zip(actor_ids, throttle, steer)
+    ]
+    client.apply_batch(commands)
+
+
+def lane_route(
+    carla_map, location, length=FLEET_ROUTE_LENGTH, spacing=FLEET_ROUTE_SPACING
+):
+    """Returns the locations of the waypoints along the lane of a location, up to length meters ahead of it. At
+    junctions the first of the next waypoints is followed"""
+    waypoint = carla_map.get_waypoint(location)
+    locations = [waypoint.transform.location]
+    for _ in range(int(length / spacing)):
+        next_waypoints = waypoint.next(spacing)
+        if not next_waypoints:
+            break
+        waypoint = next_waypoints[0]
+        locations.append(waypoint.transform.location)
+    return locations
+
+
+class VehicleFleet(object):
+    """Vehicles that follow their own route, driven together by one BatchPurePursuitController. Their poses and
+    speeds are read from the actor state store of the world, so ticking the fleet costs a single request to the
+    server. Vehicles that leave the world are dropped from the fleet"""
+
+    def __init__(self, world, actors, routes, target_speed):
+        self.world = world
+        self.actor_ids = np.array([actor.id for actor in actors], dtype=np.int64)
+        self.controller = BatchPurePursuitController(routes)
+        self.target_speed = target_speed  # meters per second
+
+        # Vehicles that were part of a frame, the ones that are then missing
+        # from a frame left the world. The others are given up on after
+        # FLEET_MAX_UNSEEN_TICKS ticks
+        self.seen = np.zeros(len(self.actor_ids), dtype=bool)
+        self.unseen_ticks = np.zeros(len(self.actor_ids), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.actor_ids)
+
+    @classmethod
+    def spawn(cls, world, count, target_speed=FLEET_TARGET_SPEED):
+        """Spawns up to count vehicles at free spawn points of the map, each one following the lane ahead of it,
+        and draws their routes. Returns None if no vehicle could be spawned"""
+        blueprints = world.world.get_blueprint_library().filter(world.args.filter)
+        spawn_points = world.town_map.get_spawn_points()
+        random.shuffle(spawn_points)
+
+        actors = []
+        routes = []
+        for spawn_point in spawn_points:
+            if len(actors) == count:
+                break
+            route = lane_route(world.town_map, spawn_point.location)
+            if len(route) < 2:
+                continue
+            actor = world.world.try_spawn_actor(random.choice(blueprints), spawn_point)
+            if actor is None:
+                continue
+            actors.append(actor)
+            routes.append([(location.x, location.y) for location in route])
+            world.register_actor_waypoints_to_draw(actor, route)
+        if len(actors) < count:
+            logging.warning("spawned %d of %d fleet vehicles", len(actors), count)
+        if len(actors) == 0:
+            return None
+        return cls(world, actors, routes, target_speed)
+
+    def _find_rows(self, actor_state):
+        """Returns the rows of the actor state store of the fleet vehicles, and a mask of the vehicles that are in
+        it"""
+        order = np.argsort(actor_state.ids, kind="stable")
+        sorted_ids = actor_state.ids[order]
+        positions = np.searchsorted(sorted_ids, self.actor_ids)
+        positions = np.minimum(positions, max(len(sorted_ids) - 1, 0))
+        if len(sorted_ids) == 0:
+            return positions, np.zeros(len(self.actor_ids), dtype=bool)
+        return order[positions], sorted_ids[positions] == self.actor_ids
+
+    def _drop(self, gone):
+        """Forgets the vehicles that are no longer in the world and returns the indices of the rest"""
+        logging.warning(
+            "fleet vehicles %s are not in the world",
+            ", ".join(str(actor_id) for actor_id in self.actor_ids[gone]),
+        )
+        keep = np.flatnonzero(~gone)
+        self.actor_ids = self.actor_ids[keep]
+        self.seen = self.seen[keep]
+        self.unseen_ticks = self.unseen_ticks[keep]
+        self.controller.keep(keep)
+        return keep
+
+    def tick(self, clock, actor_state=None):
+        """Applies the controls of the fleet vehicles in a frame from their actor states, the frame applied to the
+        world unless actor_state is given. Vehicles missing from the frame get no controls"""
+        if actor_state is None:
+            actor_state = self.world.actor_state
+        rows, present = self._find_rows(actor_state)
+        self.seen |= present
+        self.unseen_ticks[~self.seen] += 1
+        gone = ~present & (self.seen | (self.unseen_ticks > FLEET_MAX_UNSEEN_TICKS))
+        if np.any(gone):
+            keep = self._drop(gone)
+            rows = rows[keep]
+            present = present[keep]
+
+        drive = np.flatnonzero(present)
+        if len(drive) == 0:
+            return
+        rows = rows[drive]
+        accel, steer = self.controller.get_control(
+            actor_state.x[rows],
+            actor_state.y[rows],
+            actor_state.yaw[rows],
+            np.hypot(actor_state.vx[rows], actor_state.vy[rows]),
+            self.target_speed,
+            self.world.fixed_delta_seconds,
+            drive,
+        )
+        apply_vehicle_controls(self.world.client, self.actor_ids[drive], accel, steer)
+
+    def destroy(self):
+        """Destroys the fleet vehicles with a single batch of commands"""
+        self.world.client.apply_batch(
+            [carla.command.DestroyActor(int(actor_id)) for actor_id in self.actor_ids]
+        )
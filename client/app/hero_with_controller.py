@@ -1,6 +1,7 @@
 import carla
 
 from .controller import PurePursuitController
+from .route import Route, ROUTE_MIN_POINTS
 
 
 class Hero(object):
@@ -10,6 +11,7 @@ class Hero(object):
         self.control = None
         self.controller = None
         self.waypoints = []
+        self.route = None
         self.target_speed = None  # meters per second
 
     def start(self, world):
@@ -27,8 +29,13 @@ class Hero(object):
             carla.Location(x=-41.6, y=-40.5, z=0.6),
         ]
 
+        # Short routes are followed as a plain array of waypoints
         self.target_speed = 10  # meters per second
         self.controller = PurePursuitController()
+        if len(self.waypoints) > ROUTE_MIN_POINTS:
+            self.route = Route(self.waypoints)
+        else:
+            self.route = self.controller.get_waypoint_array(self.waypoints)
 
         self.world.register_actor_waypoints_to_draw(self.actor, self.waypoints)
         # self.actor.set_autopilot(True, world.args.tm_port)
@@ -37,7 +44,7 @@ class Hero(object):
 
         throttle, steer = self.controller.get_control(
             self.actor,
-            self.waypoints,
+            self.route,
             self.target_speed,
             self.world.fixed_delta_seconds,
         )
@@ -5,6 +5,11 @@ import pygame
 import datetime
 
 from .color import *
+from .actor_registry import (
+    ACTOR_VEHICLE,
+    get_actor_display_name,
+    truncate_display_name,
+)
 
 HELP_TEXT = """
 Welcome to BounCMPE CarlaSim 2D Visualizer
@@ -15,16 +20,13 @@ Welcome to BounCMPE CarlaSim 2D Visualizer
 
     F1           : toggle HUD
     I            : toggle actor ids
+    P            : toggle frame profile
+    S            : toggle snapshot actor state
     H/?          : toggle help
     ESC          : quit
 """
 
 
-def get_actor_display_name(actor, truncate=250):
-    name = " ".join(actor.type_id.replace("_", ".").title().split(".")[1:])
-    return (name[: truncate - 1] + "\u2026") if len(name) > truncate else name
-
-
 class FadingText(object):
     """Renders texts that fades out after some seconds that the user specifies"""
 
@@ -87,12 +89,16 @@ class InfoBar(object):
     def __init__(self, width, height):
         """Initializes default HUD params and content data parameters that will be displayed"""
         self.world = None
+        self.scheduler = None
+        self.profiler = None
         self.dim = (width, height)
         self._init_params()
         self._init_data_params()
 
-    def start(self, world):
+    def start(self, world, scheduler=None, profiler=None):
         self.world = world
+        self.scheduler = scheduler
+        self.profiler = profiler
 
     def _init_params(self):
         """Initialized visual parameters such as font text and size"""
@@ -113,6 +119,7 @@ class InfoBar(object):
     def _init_data_params(self):
         """Initializes the content data structures"""
         self.show_info = True
+        self.show_profile = False
         self._info_text = {}
 
     def notification(self, text, seconds=2.0):
@@ -158,28 +165,45 @@ class InfoBar(object):
             "Simulated: % 14s FPS" % round(clock.get_fps()),
             "Simulation Time: % 12s"
             % datetime.timedelta(seconds=int(self.world.simulation_time)),
+            "Actor State: % 16s"
+            % ("snapshot" if self.world.use_snapshot else "per actor"),
             # 'Map Name:          %10s' % self.town_map.name,
         ]
+        if self.scheduler is not None:
+            info_text.append(
+                "Loop Utilization: % 9d %%" % round(100 * self.scheduler.utilization)
+            )
 
         self.add_info("SIMULATION", info_text)
         self.add_info("EGO VEHICLE", hero_mode_text)
+        self._show_nearby_vehicles()
+        self._show_profile()
 
         self._notifications.tick(clock)
 
-    # def _show_nearby_vehicles(self, vehicles):
-    #     """Shows nearby vehicles of the hero actor"""
-    #     info_text = []
-    #     if self.world.hero_actor is not None and len(vehicles) > 1:
-    #         location = self.world.hero_transform.location
-    #         vehicle_list = [x[0] for x in vehicles if x[0].id != self.world.hero_actor.id]
-
-    #         def distance(v): return location.distance(v.get_location())
-    #         for n, vehicle in enumerate(sorted(vehicle_list, key=distance)):
-    #             if n > 15:
-    #                 break
-    #             vehicle_type = get_actor_display_name(vehicle, truncate=22)
-    #             info_text.append('% 5d %s' % (vehicle.id, vehicle_type))
-    #     self.add_info('NEARBY VEHICLES', info_text)
+    def _show_nearby_vehicles(self):
+        """Shows nearby vehicles of the hero actor"""
+        info_text = []
+        if self.world.hero_actor is not None and self.world.hero_transform is not None:
+            location = self.world.hero_transform.location
+            rows = self.world.get_nearest_actors(
+                location, 16, ACTOR_VEHICLE, exclude_id=self.world.hero_actor.id
+            )
+            for i in rows.tolist():
+                info = self.world.actor_state.infos[i]
+                vehicle_type = truncate_display_name(info.display_name, truncate=22)
+                info_text.append("% 5d %s" % (info.id, vehicle_type))
+        self.add_info("NEARBY VEHICLES", info_text)
+
+    def _show_profile(self):
+        """Shows the percentiles of the duration of each frame phase, in milliseconds"""
+        info_text = []
+        if self.show_profile and self.profiler is not None:
+            info_text.append("%-12s%5s%6s%6s" % ("Phase (ms)", "p50", "p95", "p99"))
+            for name, values in self.profiler.summary():
+                name = name.replace("render.", "  ")[:12]
+                info_text.append("%-12s%5.1f%6.1f%6.1f" % ((name,) + values))
+        self.add_info("FRAME PROFILE", info_text)
 
     def add_info(self, title, info):
         """Adds a block of information in the left HUD panel of the visualizer"""
@@ -10,7 +10,9 @@ from pygame.locals import K_TAB
 
 from pygame.locals import K_h
 from pygame.locals import K_i
+from pygame.locals import K_p
 from pygame.locals import K_q
+from pygame.locals import K_s
 
 
 MAP_DEFAULT_SCALE = 0.1
@@ -79,6 +81,13 @@ class InputControl(object):
                     self._hud.show_info = not self._hud.show_info
                 elif event.key == K_i:
                     self._world.show_actor_ids = not self._world.show_actor_ids
+                elif event.key == K_p:
+                    self._hud.show_profile = not self._hud.show_profile
+                elif event.key == K_s:
+                    if self._world.toggle_snapshot():
+                        self._hud.notification("Actor State: Snapshot")
+                    else:
+                        self._hud.notification("Actor State: Per Actor")
 
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 # Handle mouse wheel for zooming in and out
@@ -0,0 +1,50 @@
+import pygame
+
+from .lru import LRUCache
+
+# Labels are rotated in steps of this many degrees
+LABEL_ANGLE_STEP = 1.0
+
+# Number of rendered labels and of fonts that are kept
+LABEL_CACHE_SIZE = 1024
+LABEL_FONT_CACHE_SIZE = 32
+
+
+class LabelCache(object):
+    """Renders text labels and keeps the rendered and rotated surfaces by text, color, font, size and quantized
+    angle. Fonts are created once per name and size, sizes change with the zoom so only the recent ones are kept"""
+
+    def __init__(self, capacity=LABEL_CACHE_SIZE, angle_step=LABEL_ANGLE_STEP):
+        self.angle_step = angle_step
+        self._fonts = LRUCache(LABEL_FONT_CACHE_SIZE)
+        self._labels = LRUCache(capacity)
+
+    def get_font(self, size, name=None):
+        """Returns the font of a size. The default font of pygame is used if name is None, otherwise the system
+        font with that name"""
+        key = (name, size)
+        font = self._fonts.get(key)
+        if font is None:
+            if name is None:
+                font = pygame.font.Font(pygame.font.get_default_font(), size)
+            else:
+                font = pygame.font.SysFont(name, size)
+            self._fonts.put(key, font)
+        return font
+
+    def render(self, text, color, size, angle=0.0, name=None):
+        """Returns the surface of an antialiased label rotated by angle degrees, rounded to the angle step"""
+        steps = int(round(360.0 / self.angle_step))
+        quantized = int(round(angle / self.angle_step)) % steps
+        key = (text, tuple(color), size, quantized, name)
+        surface = self._labels.get(key)
+        if surface is None:
+            surface = self.get_font(size, name).render(text, True, color)
+            if quantized != 0:
+                surface = pygame.transform.rotate(surface, quantized * self.angle_step)
+            self._labels.put(key, surface)
+        return surface
+
+    def clear(self):
+        """Removes all the rendered labels"""
+        self._labels.clear()
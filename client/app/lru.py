@@ -0,0 +1,33 @@
+import collections
+
+
+class LRUCache(object):
+    """Dictionary with a bounded number of entries that evicts the least recently used ones"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the value stored for key and marks it as the most recently used one"""
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        """Stores a value, evicting the least recently used entries if the capacity is exceeded"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all the entries"""
+        self._entries.clear()
@@ -1,16 +1,29 @@
+import time
 import argparse
 import pygame
 
 from .hud import InfoBar
 from .hero import Hero
-from .world import World
+from .fleet import VehicleFleet
+from .world import World, MAP_CACHE_DIR, MAP_MAX_PIXEL_ERROR
 from .input_control import InputControl
+from .simulation import SimulationThread
+from .profiler import FrameProfiler
+from .scheduler import FrameScheduler, FRAME_MODES, FRAME_MODE_FPS, FRAME_SCHEDULER_FPS
 
 from .color import *
 
+# Wall seconds between two progress reports of the headless mode
+HEADLESS_REPORT_PERIOD = 5.0
+
 
 def game_loop(args):
     """Initialized, Starts and runs all the needed modules for No Rendering Mode"""
+    simulation = None
+    world = None
+    hero = None
+    fleet = None
+    profiler = FrameProfiler(record=args.profile_out is not None)
     try:
 
         # Init Pygame
@@ -32,43 +45,136 @@ def game_loop(args):
         pygame.display.flip()
 
         # Init
+        scheduler = FrameScheduler(args.frame_mode, args.fps, args.render_every)
         hud = InfoBar(args.width, args.height)
         input_control = InputControl()
         world = World(args)
         hero = Hero()
 
         # For each module, assign other modules that are going to be used inside that module
-        hud.start(world)
+        hud.start(world, scheduler, profiler)
         input_control.start(hud, world)
-        world.start(input_control)
+        world.start(input_control, profiler)
 
         hero.start(world)
+        if args.fleet > 0:
+            fleet = VehicleFleet.spawn(world, args.fleet)
+
+        # In async render mode the simulation is stepped on its own thread and
+        # the loop renders the latest frame it published
+        if args.async_render:
+            simulation = SimulationThread(world, hero, fleet)
+            simulation.start()
 
         # Game loop
-        clock = pygame.time.Clock()
+        clock = scheduler.clock
         while True:
-            clock.tick_busy_loop(500)
+            with profiler.phase("wait"):
+                scheduler.wait(simulation)
 
             # Tick all modules
-            world.tick(clock)
-            hero.tick(clock)
-            hud.tick(clock)
-            input_control.tick(clock)
+            if simulation is not None:
+                simulation.check()
+                with profiler.phase("world.tick"):
+                    world.apply_frame(simulation.latest_frame)
+            else:
+                with profiler.phase("world.tick"):
+                    world.tick(clock)
+                with profiler.phase("hero.tick"):
+                    hero.tick(clock)
+                if fleet is not None:
+                    with profiler.phase("fleet.tick"):
+                        fleet.tick(clock)
+            with profiler.phase("input.tick"):
+                input_control.tick(clock)
+            if not scheduler.should_render(world.frame):
+                profiler.end_frame()
+                continue
+            with profiler.phase("hud.tick"):
+                hud.tick(clock)
 
             # Render all modules
-            display.fill(COLOR_ALUMINIUM_4)
-            world.render(display)
-            hud.render(display)
-            input_control.render(display)
+            with profiler.phase("world.render"):
+                display.fill(COLOR_ALUMINIUM_4)
+                world.render(display)
+            with profiler.phase("hud.render"):
+                hud.render(display)
+                input_control.render(display)
 
-            pygame.display.flip()
+            with profiler.phase("flip"):
+                pygame.display.flip()
+            profiler.end_frame()
 
     except KeyboardInterrupt:
         print("\nCancelled by user. Bye!")
 
     finally:
+        if simulation is not None:
+            simulation.stop()
+        if fleet is not None:
+            fleet.destroy()
         if hero is not None:
             hero.destroy()
+        if world is not None:
+            world.destroy()
+        if args.profile_out is not None:
+            profiler.save(args.profile_out)
+
+
+def headless_loop(args):
+    """Runs the simulation without display, the world is ticked as fast as the server goes and the achieved
+    simulation seconds per wall second are reported"""
+    world = None
+    hero = None
+    fleet = None
+    start_time = time.monotonic()
+    try:
+        world = World(args)
+        hero = Hero()
+
+        world.start_headless()
+        hero.start(world)
+        if args.fleet > 0:
+            fleet = VehicleFleet.spawn(world, args.fleet)
+
+        start_time = time.monotonic()
+        report_time = start_time
+        report_simulation_time = world.simulation_time
+        while args.duration <= 0.0 or world.simulation_time < args.duration:
+            world.tick(None)
+            hero.tick(None)
+            if fleet is not None:
+                fleet.tick(None)
+
+            now = time.monotonic()
+            if now - report_time >= HEADLESS_REPORT_PERIOD:
+                print(
+                    "%.1f sim-s, %.2f sim-s per wall-s"
+                    % (
+                        world.simulation_time,
+                        (world.simulation_time - report_simulation_time)
+                        / (now - report_time),
+                    )
+                )
+                report_time = now
+                report_simulation_time = world.simulation_time
+
+    except KeyboardInterrupt:
+        print("\nCancelled by user. Bye!")
+
+    finally:
+        if fleet is not None:
+            fleet.destroy()
+        if hero is not None:
+            hero.destroy()
+        if world is not None:
+            world.destroy()
+            wall_time = time.monotonic() - start_time
+            if wall_time > 0.0:
+                print(
+                    "Simulated %.1f sim-s in %.1f wall-s, %.2f sim-s per wall-s"
+                    % (world.simulation_time, wall_time, world.simulation_time / wall_time)
+                )
 
 
 def main():
@@ -111,12 +217,83 @@ def main():
         default="1280x720",
         help="window resolution (default: 1280x720)",
     )
+    argparser.add_argument(
+        "--frame-mode",
+        choices=FRAME_MODES,
+        default=FRAME_MODE_FPS,
+        help="pace the display at --fps, render every server tick or one out of --render-every ticks (default: %s)"
+        % FRAME_MODE_FPS,
+    )
+    argparser.add_argument(
+        "--fps",
+        metavar="N",
+        default=FRAME_SCHEDULER_FPS,
+        type=int,
+        help="target frame rate of the fps frame mode (default: %s)" % FRAME_SCHEDULER_FPS,
+    )
+    argparser.add_argument(
+        "--render-every",
+        metavar="N",
+        default=1,
+        type=int,
+        help="render one out of N simulation ticks in the every frame mode (default: 1)",
+    )
     argparser.add_argument(
         "--filter",
         metavar="PATTERN",
         default="vehicle.audi.*",
         help='actor filter (default: "vehicle.audi.*")',
     )
+    argparser.add_argument(
+        "--legacy-tick",
+        action="store_true",
+        help="query every actor transform separately instead of using world snapshots",
+    )
+    argparser.add_argument(
+        "--async-render",
+        action="store_true",
+        help="step the simulation on its own thread and render its latest state at the display rate",
+    )
+    argparser.add_argument(
+        "--fleet",
+        metavar="N",
+        default=0,
+        type=int,
+        help="spawn N vehicles that follow the lane ahead of them, driven by one batched controller (default: 0)",
+    )
+    argparser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        default=MAP_CACHE_DIR,
+        help="directory of the map caches (default: %s)" % MAP_CACHE_DIR,
+    )
+    argparser.add_argument(
+        "--max-pixel-error",
+        metavar="PX",
+        default=MAP_MAX_PIXEL_ERROR,
+        type=float,
+        help="largest deviation of the drawn roads from the map, 0 samples roads every 5 cm (default: %s)"
+        % MAP_MAX_PIXEL_ERROR,
+    )
+
+    argparser.add_argument(
+        "--profile-out",
+        metavar="FILE",
+        default=None,
+        help="write the duration of the phases of every frame to FILE, as JSON if it ends with .json, CSV otherwise",
+    )
+    argparser.add_argument(
+        "--headless",
+        action="store_true",
+        help="run without display, ticking the simulation as fast as the server goes",
+    )
+    argparser.add_argument(
+        "--duration",
+        metavar="S",
+        default=0.0,
+        type=float,
+        help="simulation seconds to run in headless mode, 0 runs until cancelled (default: 0)",
+    )
 
     # Parse arguments
     args = argparser.parse_args()
@@ -124,4 +301,7 @@ def main():
     args.width, args.height = [int(x) for x in args.res.split("x")]
 
     # Run game loop
-    game_loop(args)
+    if args.headless:
+        headless_loop(args)
+    else:
+        game_loop(args)
@@ -0,0 +1,218 @@
+import os
+import re
+import glob
+import json
+import hashlib
+import mmap
+import zlib
+import shutil
+import pygame
+import functools
+import concurrent.futures
+
+from .map_tiles import MapTilePyramid
+
+MAP_CACHE_VERSION = 2
+MAP_CACHE_INDEX = "index.json"
+MAP_CACHE_TILES = "tiles.bin"
+
+# Number of hexadecimal digits of the parameters hash in the cache names
+MAP_CACHE_PARAMETERS_HASH_LENGTH = 10
+
+# Parameters that must match for a cached map to be reused
+MAP_CACHE_KEYS = (
+    "version",
+    "opendrive_hash",
+    "requested_pixels_per_meter",
+    "show_triggers",
+    "show_connections",
+    "show_spawn_points",
+    "max_pixel_error",
+    "tile_size",
+    "levels",
+)
+
+
+# Pyramid used by the rasterization worker processes
+_worker_pyramid = None
+
+
+def rasterize_tile(pyramid, key):
+    """Returns the zlib compressed RGB plane of a tile, or None if the tile has no content"""
+    level, tx, ty = key
+    if pyramid.is_empty(level, tx, ty):
+        return None
+    surface = pyramid.render_tile(level, tx, ty)
+    return zlib.compress(pygame.image.tostring(surface, "RGB"), 6)
+
+
+def _init_rasterizer(canvas, tile_size, levels):
+    """Builds the pyramid of a rasterization worker process"""
+    global _worker_pyramid
+    _worker_pyramid = MapTilePyramid(
+        canvas.width_in_pixels, canvas=canvas, tile_size=tile_size, levels=levels
+    )
+
+
+def _rasterize_worker_tile(key):
+    return rasterize_tile(_worker_pyramid, key)
+
+
+def get_opendrive_hash(carla_map):
+    """Returns the sha1 of the OpenDRIVE content of a map, which identifies every cache derived from it"""
+    hash_func = hashlib.sha1()
+    hash_func.update(carla_map.to_opendrive().encode("UTF-8"))
+    return str(hash_func.hexdigest())
+
+
+def get_parameters_hash(parameters):
+    """Returns a short sha1 of the parameters a cache was built with, so that caches of the same town built with
+    different parameters are stored side by side"""
+    hash_func = hashlib.sha1()
+    hash_func.update(json.dumps(parameters, sort_keys=True).encode("UTF-8"))
+    return hash_func.hexdigest()[:MAP_CACHE_PARAMETERS_HASH_LENGTH]
+
+
+def get_cache_path(dirname, town_name, opendrive_hash, parameters):
+    """Returns the directory where the tiles of a town baked with the given parameters are stored"""
+    return os.path.join(
+        dirname,
+        "%s_%s_%s" % (town_name, opendrive_hash, get_parameters_hash(parameters)),
+    )
+
+
+def get_geometry_path(dirname, town_name, opendrive_hash, parameters):
+    """Returns the file where the road geometry of a town extracted with the given parameters is stored"""
+    return get_cache_path(dirname, town_name, opendrive_hash, parameters) + ".npz"
+
+
+def remove_stale_caches(dirname, town_name, opendrive_hash):
+    """Removes the caches of previous versions of a town, and the caches of its current version stored without a
+    parameters hash by previous versions of the client"""
+    pattern = re.compile(
+        re.escape(town_name) + r"_([0-9a-f]{40})(_[0-9a-f]+)?(\.\w+)*$"
+    )
+    for path in glob.glob(os.path.join(dirname, town_name) + "_*"):
+        match = pattern.match(os.path.basename(path))
+        if match is None:
+            continue
+        if match.group(1) == opendrive_hash and match.group(2) is not None:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+class MapTileStore(object):
+    """Tiles of a baked map stored as zlib compressed RGB planes in a single memory mapped file. A small JSON index
+    holds the parameters the map was baked with and the location of every tile in the file, so tiles are only read
+    and decompressed when they are first shown"""
+
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+        self.background = tuple(index["background"])
+        self._tiles = index["tiles"]
+        self._file = open(os.path.join(path, MAP_CACHE_TILES), "rb")
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b""
+
+    @staticmethod
+    def read_index(path):
+        """Returns the index of a cache directory, or None if it does not exist or is not readable"""
+        try:
+            with open(os.path.join(path, MAP_CACHE_INDEX), "r") as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def open(cls, path, parameters):
+        """Opens a cache directory if it was baked with the given parameters, otherwise returns None"""
+        index = cls.read_index(path)
+        if index is None:
+            return None
+        for key in MAP_CACHE_KEYS:
+            if index.get(key) != parameters.get(key):
+                return None
+        if not os.path.isfile(os.path.join(path, MAP_CACHE_TILES)):
+            return None
+        return cls(path, index)
+
+    @staticmethod
+    def write(path, pyramid, metadata, workers=None):
+        """Rasterizes every tile of a pyramid built from a map canvas and stores them in a cache directory. Tiles
+        are disjoint, so they are rasterized by a pool of worker processes, one per core unless workers is given,
+        and merged in order into the tiles file. The index is written last, so an interrupted bake never leaves a
+        cache that looks valid"""
+        if workers is None:
+            workers = os.cpu_count() or 1
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        keys = list(pyramid.tile_keys())
+        executor = None
+        if workers > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_rasterizer,
+                initargs=(pyramid.canvas, pyramid.tile_size, pyramid.levels),
+            )
+            results = executor.map(_rasterize_worker_tile, keys, chunksize=8)
+        else:
+            results = map(functools.partial(rasterize_tile, pyramid), keys)
+
+        tiles = dict()
+        try:
+            with open(os.path.join(tmp_path, MAP_CACHE_TILES), "wb") as tiles_file:
+                offset = 0
+                for (level, tx, ty), data in zip(keys, results):
+                    rect = pyramid.tile_rect(level, tx, ty)
+                    key = "%d/%d/%d" % (level, tx, ty)
+                    if data is None:
+                        # Tiles without content are filled with the background
+                        tiles[key] = [offset, 0, rect.width, rect.height]
+                        continue
+                    tiles_file.write(data)
+                    tiles[key] = [offset, len(data), rect.width, rect.height]
+                    offset += len(data)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        index = dict(metadata)
+        index["version"] = MAP_CACHE_VERSION
+        index["tile_size"] = pyramid.tile_size
+        index["levels"] = pyramid.levels
+        index["background"] = list(pyramid.canvas.background)
+        index["tiles"] = tiles
+        with open(os.path.join(tmp_path, MAP_CACHE_INDEX), "w") as index_file:
+            json.dump(index, index_file)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+    def load_tile(self, level, tx, ty):
+        """Decompresses a tile into a new surface"""
+        offset, length, width, height = self._tiles["%d/%d/%d" % (level, tx, ty)]
+        if length == 0:
+            surface = pygame.Surface((width, height))
+            surface.fill(self.background)
+        else:
+            data = zlib.decompress(self._data[offset : offset + length])
+            surface = pygame.image.fromstring(data, (width, height), "RGB")
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        return surface
+
+    def close(self):
+        """Releases the memory map and the tiles file"""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
@@ -0,0 +1,235 @@
+import math
+import pygame
+import numpy as np
+
+from .lru import LRUCache
+
+MAP_TILE_SIZE = 512
+MAP_TILE_LEVELS = 4
+MAP_TILE_CACHE_SIZE = 96
+
+# Kinds of drawing commands recorded by the map canvas
+DRAW_POLYGON = 0
+DRAW_LINES = 1
+DRAW_IMAGE = 2
+
+
+class MapCanvas(object):
+    """Records the drawing commands of the map in pixel coordinates of the full resolution map, so that any region
+    of the map can be rasterized later at any zoom level without keeping the full resolution image in memory"""
+
+    def __init__(self, width_in_pixels, background=(0, 0, 0)):
+        self.width_in_pixels = width_in_pixels
+        self.background = tuple(background)
+        self._commands = []
+        self._bounds = []
+        self._bounds_array = None
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_bounds_array"] = None
+        return state
+
+    def _add(self, kind, color, points, width, payload=None):
+        """Stores a command together with its bounding box, grown by the line width"""
+        points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        if len(points) == 0:
+            return
+        low = points.min(axis=0) - width
+        high = points.max(axis=0) + width
+        self._commands.append(
+            (kind, None if color is None else tuple(color), points, width, payload)
+        )
+        self._bounds.append((low[0], low[1], high[0], high[1]))
+        self._bounds_array = None
+
+    def fill(self, color):
+        """Sets the background color of the map"""
+        self.background = tuple(color)
+
+    def polygon(self, color, points, width=0):
+        """Records a polygon, filled if width is zero"""
+        if len(points) > 2:
+            self._add(DRAW_POLYGON, color, points, width)
+
+    def lines(self, color, closed, points, width=1):
+        """Records a polyline"""
+        if len(points) >= 2:
+            self._add(DRAW_LINES, color, points, width, closed)
+
+    def line(self, color, start_pos, end_pos, width=1):
+        """Records a single line segment"""
+        self._add(DRAW_LINES, color, [start_pos, end_pos], width, False)
+
+    def blit(self, surface, dest):
+        """Records an image placed with its top left corner at dest"""
+        rect = surface.get_rect(topleft=(int(dest[0]), int(dest[1])))
+        payload = (pygame.image.tostring(surface, "RGBA"), surface.get_size())
+        self._add(DRAW_IMAGE, None, [rect.topleft, rect.bottomright], 0, payload)
+
+    def query(self, left, top, right, bottom):
+        """Returns the indices, in drawing order, of the commands that may touch the given region"""
+        if self._bounds_array is None:
+            self._bounds_array = np.array(self._bounds, dtype=np.int64).reshape(-1, 4)
+        b = self._bounds_array
+        mask = (b[:, 0] <= right) & (b[:, 2] >= left)
+        mask &= (b[:, 1] <= bottom) & (b[:, 3] >= top)
+        return np.flatnonzero(mask)
+
+    def rasterize(self, surface, origin, factor):
+        """Draws the region of the map whose top left corner is origin, in full resolution pixels, into surface.
+        The map is scaled by factor, which is 1.0 for the full resolution map"""
+        surface.fill(self.background)
+        width, height = surface.get_size()
+        left, top = origin
+        right = left + width / factor
+        bottom = top + height / factor
+        origin = np.array(origin, dtype=np.float64)
+
+        for i in self.query(left, top, right, bottom):
+            kind, color, points, width, payload = self._commands[i]
+            points = np.floor((points - origin) * factor).astype(np.int32)
+            if width > 0 and factor != 1.0:
+                width = max(1, int(round(width * factor)))
+
+            if kind == DRAW_POLYGON:
+                pygame.draw.polygon(surface, color, points.tolist(), width)
+            elif kind == DRAW_LINES:
+                pygame.draw.lines(surface, color, payload, points.tolist(), width)
+            elif kind == DRAW_IMAGE:
+                data, size = payload
+                image = pygame.image.fromstring(data, size, "RGBA")
+                if factor != 1.0:
+                    scaled_size = (
+                        max(1, int(size[0] * factor)),
+                        max(1, int(size[1] * factor)),
+                    )
+                    image = pygame.transform.smoothscale(image, scaled_size)
+                surface.blit(image, points[0].tolist())
+
+
+class MapTilePyramid(object):
+    """Multi resolution set of square tiles of the map. Level 0 has the full resolution and every next level halves
+    it. Tiles are loaded from a baked tile store, or rasterized from the map canvas, the first time they are needed
+    and are kept in a bounded cache, so that only the tiles around the visible region of the map are held in memory"""
+
+    def __init__(
+        self,
+        width_in_pixels,
+        canvas=None,
+        store=None,
+        tile_size=MAP_TILE_SIZE,
+        levels=MAP_TILE_LEVELS,
+        cache_size=MAP_TILE_CACHE_SIZE,
+    ):
+        self.canvas = canvas
+        self.store = store
+        self.width_in_pixels = width_in_pixels
+        self.tile_size = tile_size
+        self.levels = levels
+        self._tiles = LRUCache(cache_size)
+        self._scaled_tiles = LRUCache(cache_size)
+        self._scaled_for = None
+
+    def level_for_scale(self, scale):
+        """Returns the coarsest level whose resolution is not lower than the given scale"""
+        if scale >= 1.0:
+            return 0
+        level = int(math.floor(math.log2(1.0 / scale)))
+        return max(0, min(self.levels - 1, level))
+
+    def level_size(self, level):
+        """Returns the width in pixels of the map at a level"""
+        return int(math.ceil(self.width_in_pixels / float(1 << level)))
+
+    def tile_count(self, level):
+        """Returns the number of tiles per side at a level"""
+        return int(math.ceil(self.level_size(level) / float(self.tile_size)))
+
+    def tile_rect(self, level, tx, ty):
+        """Returns the rect of a tile in pixels of its level"""
+        size = self.level_size(level)
+        x = tx * self.tile_size
+        y = ty * self.tile_size
+        return pygame.Rect(
+            x, y, min(self.tile_size, size - x), min(self.tile_size, size - y)
+        )
+
+    def tile_keys(self):
+        """Yields the level and position of every tile of the pyramid"""
+        for level in range(self.levels):
+            count = self.tile_count(level)
+            for ty in range(count):
+                for tx in range(count):
+                    yield (level, tx, ty)
+
+    def is_empty(self, level, tx, ty):
+        """Returns True if no drawing command of the canvas touches a tile"""
+        rect = self.tile_rect(level, tx, ty)
+        scale = 1 << level
+        commands = self.canvas.query(
+            rect.left * scale, rect.top * scale, rect.right * scale, rect.bottom * scale
+        )
+        return len(commands) == 0
+
+    def get_tile(self, level, tx, ty):
+        """Returns the surface of a tile, rasterizing it if it is not cached"""
+        key = (level, tx, ty)
+        tile = self._tiles.get(key)
+        if tile is None:
+            tile = self.render_tile(level, tx, ty)
+            self._tiles.put(key, tile)
+        return tile
+
+    def render_tile(self, level, tx, ty):
+        """Loads a tile from the tile store or rasterizes it from the map canvas"""
+        if self.store is not None:
+            return self.store.load_tile(level, tx, ty)
+
+        rect = self.tile_rect(level, tx, ty)
+        factor = 1.0 / (1 << level)
+        surface = pygame.Surface(rect.size)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        self.canvas.rasterize(surface, (rect.x / factor, rect.y / factor), factor)
+        return surface
+
+    def blit_visible(self, destination, scale, rect, offset=(0, 0)):
+        """Blits into destination the tiles of the map scaled by scale that intersect rect. Rect is in pixel
+        coordinates of the scaled map, and offset is the pixel of the scaled map at the top left corner of
+        destination"""
+        level = self.level_for_scale(scale)
+        if self._scaled_for != (level, scale):
+            self._scaled_tiles.clear()
+            self._scaled_for = (level, scale)
+
+        # Size of a pixel of the level in destination pixels
+        ratio = scale * (1 << level)
+        step = self.tile_size * ratio
+        count = self.tile_count(level)
+
+        first_x = max(0, int(rect.left // step))
+        first_y = max(0, int(rect.top // step))
+        last_x = min(count - 1, int((rect.right - 1) // step))
+        last_y = min(count - 1, int((rect.bottom - 1) // step))
+
+        for ty in range(first_y, last_y + 1):
+            for tx in range(first_x, last_x + 1):
+                tile = self.get_tile(level, tx, ty)
+                left = int(round(tx * step))
+                top = int(round(ty * step))
+                if ratio != 1.0:
+                    scaled = self._scaled_tiles.get((tx, ty))
+                    if scaled is None:
+                        right = int(round((tx * self.tile_size + tile.get_width()) * ratio))
+                        bottom = int(
+                            round((ty * self.tile_size + tile.get_height()) * ratio)
+                        )
+                        size = (max(1, right - left), max(1, bottom - top))
+                        scaled = pygame.transform.smoothscale(tile, size)
+                        self._scaled_tiles.put((tx, ty), scaled)
+                    tile = scaled
+                destination.blit(tile, (left - offset[0], top - offset[1]))
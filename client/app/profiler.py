@@ -0,0 +1,109 @@
+import csv
+import json
+import time
+import contextlib
+import collections
+
+import numpy as np
+
+# Number of recent frames the percentiles are computed over
+PROFILER_WINDOW = 300
+
+# Percentiles shown in the HUD and written to the trace summary
+PROFILER_PERCENTILES = (50, 95, 99)
+
+
+class FrameProfiler(object):
+    """Measures the duration of the phases of each frame. A phase is timed either with the phase context manager or
+    with lap, which records the time since the previous lap or mark. Durations of the last frames are kept per
+    phase for the percentiles, and every frame is recorded when a trace is going to be saved"""
+
+    def __init__(self, window=PROFILER_WINDOW, record=False):
+        self.window = window
+        self.record = record
+        self.frames = []
+        self._samples = collections.OrderedDict()
+        self._current = dict()
+        self._frame_start = time.perf_counter()
+        self._lap_start = self._frame_start
+
+    def add(self, name, seconds):
+        """Adds a duration to a phase of the current frame"""
+        self._current[name] = self._current.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the enclosed block as a phase of the current frame"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def mark(self):
+        """Starts timing the next lap"""
+        self._lap_start = time.perf_counter()
+
+    def lap(self, name):
+        """Records the time since the previous lap or mark as a phase of the current frame"""
+        now = time.perf_counter()
+        self.add(name, now - self._lap_start)
+        self._lap_start = now
+
+    def end_frame(self):
+        """Stores the phases of the current frame, its total duration is the time since the previous end_frame"""
+        now = time.perf_counter()
+        self._current["frame"] = now - self._frame_start
+        self._frame_start = now
+
+        for name, seconds in self._current.items():
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = collections.deque(maxlen=self.window)
+            samples.append(seconds)
+        if self.record:
+            self.frames.append(self._current)
+        self._current = dict()
+
+    def percentiles(self, name):
+        """Returns the percentiles of the duration of a phase over the window, in milliseconds"""
+        samples = self._samples.get(name)
+        if not samples:
+            return tuple(0.0 for _ in PROFILER_PERCENTILES)
+        return tuple(1000.0 * np.percentile(samples, PROFILER_PERCENTILES))
+
+    def summary(self):
+        """Returns the name and percentiles of every phase, in the order they were first seen"""
+        return [(name, self.percentiles(name)) for name in self._samples]
+
+    def save(self, path):
+        """Writes the recorded frames, in milliseconds, as JSON if the path ends with .json and as CSV otherwise"""
+        names = list(self._samples)
+        if path.lower().endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(
+                    {
+                        "percentiles": list(PROFILER_PERCENTILES),
+                        "summary": {
+                            name: list(values) for name, values in self.summary()
+                        },
+                        "frames": [
+                            {name: 1000.0 * seconds for name, seconds in frame.items()}
+                            for frame in self.frames
+                        ],
+                    },
+                    f,
+                    indent=1,
+                )
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["index"] + names)
+                for index, frame in enumerate(self.frames):
+                    writer.writerow(
+                        [index]
+                        + [
+                            "%.4f" % (1000.0 * frame[name]) if name in frame else ""
+                            for name in names
+                        ]
+                    )
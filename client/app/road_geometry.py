@@ -0,0 +1,367 @@
+import os
+import math
+import numpy as np
+
+import carla
+
+ROAD_GEOMETRY_VERSION = 2
+
+# Longest step between two samples of a lane when sampling adaptively, in meters
+GEOMETRY_MAX_STEP = 5.0
+
+# Width covered by the shoulders, parkings and sidewalks beyond the edge of a
+# lane, which are drawn from the samples of the lane
+GEOMETRY_SIDE_REACH = 5.0
+
+# Kinds of lane polylines
+LANE_ROAD = 0
+LANE_SHOULDER = 1
+LANE_PARKING = 2
+LANE_SIDEWALK = 3
+
+# Columns of the samples array
+SAMPLE_X = 0
+SAMPLE_Y = 1
+SAMPLE_Z = 2
+SAMPLE_YAW = 3
+SAMPLE_PITCH = 4
+SAMPLE_WIDTH = 5
+
+# Columns of the markings array, a negative type means there is no marking
+MARKING_LEFT_TYPE = 0
+MARKING_LEFT_COLOR = 1
+MARKING_RIGHT_TYPE = 2
+MARKING_RIGHT_COLOR = 3
+
+
+def sampling_error(start, end, step):
+    """Returns an estimate, in meters, of the largest distance between the lane edges of the road between two
+    waypoints and the straight segments joining them"""
+    start_t = start.transform.rotation
+    end_t = end.transform.rotation
+    heading = abs((end_t.yaw - start_t.yaw + 180.0) % 360.0 - 180.0)
+    heading = math.radians(heading)
+
+    # Sagitta of the arc through both waypoints, at the outermost edge drawn
+    # from them
+    reach = 0.5 * max(start.lane_width, end.lane_width) + GEOMETRY_SIDE_REACH
+    error = (step + reach * heading) * heading / 8.0
+
+    # Lane widths are cubic polynomials in OpenDRIVE, a linear interpolation
+    # of the width deviates from them by a fraction of its change
+    error += abs(end.lane_width - start.lane_width) / 8.0
+    return error
+
+
+def walk_road(waypoint, precision, tolerance=0.0, max_step=GEOMETRY_MAX_STEP, signature=None):
+    """Generates the waypoints of a road id. Stops when the road id differs. If tolerance is zero, waypoints are
+    spaced by precision. Otherwise the spacing adapts to the road: it doubles, up to max_step, while the road can be
+    approximated by straight segments within tolerance, and is halved, down to precision, where the road curves or
+    where signature, a function describing the lane markings and neighbour lanes of a waypoint, changes"""
+    if tolerance <= 0.0:
+        waypoints = [waypoint]
+        nxt = waypoint.next(precision)
+        if len(nxt) > 0:
+            nxt = nxt[0]
+            while nxt.road_id == waypoint.road_id:
+                waypoints.append(nxt)
+                nxt = nxt.next(precision)
+                if len(nxt) > 0:
+                    nxt = nxt[0]
+                else:
+                    break
+        return waypoints
+
+    waypoints = [waypoint]
+    current = waypoint
+    current_signature = signature(current) if signature else None
+    step = max_step
+    while True:
+        nxt = current.next(step)
+        nxt = nxt[0] if len(nxt) > 0 else None
+        accept = nxt is not None and nxt.road_id == waypoint.road_id
+        if accept:
+            nxt_signature = signature(nxt) if signature else None
+            accept = nxt_signature == current_signature
+            accept = accept and sampling_error(current, nxt, step) <= tolerance
+
+        if not accept and step > precision:
+            # Refine the step until the road is approximated within tolerance or
+            # the change of the lane is located within precision
+            step = max(precision, step * 0.5)
+            continue
+
+        if nxt is None or nxt.road_id != waypoint.road_id:
+            break
+
+        waypoints.append(nxt)
+        current = nxt
+        current_signature = nxt_signature
+        step = min(max_step, step * 2.0)
+    return waypoints
+
+
+def arc_length(points):
+    """Returns the distance along a (N, 2) polyline of every point"""
+    segments = np.hypot(*np.diff(points, axis=0).T)
+    return np.concatenate(([0.0], np.cumsum(segments)))
+
+
+def interpolate_polyline(points, distances):
+    """Returns the points of a polyline at the given distances along it. Columns other than the first two are
+    interpolated linearly too"""
+    s = arc_length(points[:, :2])
+    return np.stack(
+        [np.interp(distances, s, points[:, i]) for i in range(points.shape[1])], axis=-1
+    )
+
+
+def polyline_intervals(points, starts, length):
+    """Returns the pieces of a (N, 2) polyline that start at the given distances along it and have a given length.
+    The pieces keep the points of the polyline inside them, so they follow its curves"""
+    s = arc_length(points)
+    pieces = []
+    for start in starts:
+        end = min(start + length, s[-1])
+        inside = np.flatnonzero((s > start) & (s < end))
+        ends = interpolate_polyline(points, [start, end])
+        pieces.append(np.concatenate((ends[:1], points[inside], ends[1:])))
+    return pieces
+
+
+class RoadGeometry(object):
+    """Lane polylines of a map stored as flat NumPy arrays. The samples of polyline i are the rows
+    offsets[i]:offsets[i + 1] of samples and markings. Polylines are stored in drawing order: the shoulders, parkings
+    and sidewalks of every road followed by the driving roads, all sorted by height"""
+
+    def __init__(
+        self,
+        samples,
+        markings,
+        offsets,
+        kind,
+        side,
+        road_id,
+        lane_id,
+        lane_type,
+        is_junction,
+        precision,
+        tolerance=0.0,
+    ):
+        self.samples = samples
+        self.markings = markings
+        self.offsets = offsets
+        self.kind = kind
+        self.side = side
+        self.road_id = road_id
+        self.lane_id = lane_id
+        self.lane_type = lane_type
+        self.is_junction = is_junction
+        self.precision = precision
+        self.tolerance = tolerance
+
+    def __len__(self):
+        return len(self.kind)
+
+    def polyline(self, index):
+        """Returns the (N, 6) samples of a polyline"""
+        return self.samples[self.offsets[index] : self.offsets[index + 1]]
+
+    def polyline_markings(self, index):
+        """Returns the (N, 4) lane markings of a polyline"""
+        return self.markings[self.offsets[index] : self.offsets[index + 1]]
+
+    @classmethod
+    def extract(cls, carla_map, precision=0.05, tolerance=0.0):
+        """Walks the topology of a map and reads every lane into arrays. This is the only step that talks to the
+        server. Lanes are sampled every precision meters, or adaptively if a tolerance in meters is given"""
+        samples = []
+        markings = []
+        offsets = [0]
+        polylines = []
+        roads = []
+
+        def read(waypoints):
+            for w in waypoints:
+                t = w.transform
+                samples.append(
+                    (
+                        t.location.x,
+                        t.location.y,
+                        t.location.z,
+                        t.rotation.yaw,
+                        t.rotation.pitch,
+                        w.lane_width,
+                    )
+                )
+                row = []
+                for lane_marking in (w.left_lane_marking, w.right_lane_marking):
+                    if lane_marking is None:
+                        row += [-1, -1]
+                    else:
+                        row += [int(lane_marking.type), int(lane_marking.color)]
+                markings.append(row)
+            offsets.append(len(samples))
+
+        def add(kind, side, waypoints):
+            if len(waypoints) < 2:
+                return
+            w = waypoints[0]
+            read(waypoints)
+            polylines.append(
+                (kind, side, w.road_id, w.lane_id, int(w.lane_type), w.is_junction)
+            )
+
+        def get_side_lanes(w):
+            """Returns the lanes next to a waypoint until the next driving lane, on the left and on the right"""
+            sides = []
+            for get_next in (lambda x: x.get_left_lane(), lambda x: x.get_right_lane()):
+                lanes = []
+                lane = get_next(w)
+                while lane and lane.lane_type != carla.LaneType.Driving:
+                    lanes.append(lane)
+                    lane = get_next(lane)
+                sides.append(lanes)
+            return sides
+
+        def signature(w):
+            """Describes what is drawn around a waypoint, sampling is refined where it changes"""
+            lane_markings = tuple(
+                None if m is None else (m.type, m.color)
+                for m in (w.left_lane_marking, w.right_lane_marking)
+            )
+            sides = tuple(
+                tuple(lane.lane_type for lane in lanes) for lanes in side_lanes_of(w)
+            )
+            return lane_markings, sides
+
+        # Neighbour lanes read while sampling a road, reused when classifying them
+        side_lanes_cache = dict()
+
+        def side_lanes_of(w):
+            if id(w) not in side_lanes_cache:
+                side_lanes_cache[id(w)] = (w, get_side_lanes(w))
+            return side_lanes_cache[id(w)][1]
+
+        topology = [x[0] for x in carla_map.get_topology()]
+        topology = sorted(topology, key=lambda w: w.transform.location.z)
+        for waypoint in topology:
+            waypoints = walk_road(
+                waypoint,
+                precision,
+                tolerance,
+                signature=signature if tolerance > 0.0 else None,
+            )
+            roads.append(waypoints)
+
+            # Classify the lanes next to the road until the next driving lane
+            side_lanes = {
+                carla.LaneType.Shoulder: [[], []],
+                carla.LaneType.Parking: [[], []],
+                carla.LaneType.Sidewalk: [[], []],
+            }
+            for w in waypoints:
+                for side, lanes in enumerate(side_lanes_of(w)):
+                    for lane in lanes:
+                        if lane.lane_type in side_lanes:
+                            side_lanes[lane.lane_type][side].append(lane)
+
+            for kind, lane_type in (
+                (LANE_SHOULDER, carla.LaneType.Shoulder),
+                (LANE_PARKING, carla.LaneType.Parking),
+                (LANE_SIDEWALK, carla.LaneType.Sidewalk),
+            ):
+                for side in (0, 1):
+                    add(kind, side, side_lanes[lane_type][side])
+            side_lanes_cache.clear()
+
+        for waypoints in roads:
+            add(LANE_ROAD, 0, waypoints)
+
+        polylines = np.array(polylines, dtype=np.int64).reshape(-1, 6)
+        return cls(
+            samples=np.array(samples, dtype=np.float32).reshape(-1, 6),
+            markings=np.array(markings, dtype=np.int16).reshape(-1, 4),
+            offsets=np.array(offsets, dtype=np.int64),
+            kind=polylines[:, 0].astype(np.int8),
+            side=polylines[:, 1].astype(np.int8),
+            road_id=polylines[:, 2].astype(np.int32),
+            lane_id=polylines[:, 3].astype(np.int32),
+            lane_type=polylines[:, 4].astype(np.int32),
+            is_junction=polylines[:, 5].astype(bool),
+            precision=precision,
+            tolerance=tolerance,
+        )
+
+    def save(self, path):
+        """Writes the arrays to a compressed npz file"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as geometry_file:
+            np.savez_compressed(
+                geometry_file,
+                version=ROAD_GEOMETRY_VERSION,
+                precision=self.precision,
+                tolerance=self.tolerance,
+                samples=self.samples,
+                markings=self.markings,
+                offsets=self.offsets,
+                kind=self.kind,
+                side=self.side,
+                road_id=self.road_id,
+                lane_id=self.lane_id,
+                lane_type=self.lane_type,
+                is_junction=self.is_junction,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, precision=0.05, tolerance=0.0):
+        """Reads the arrays from an npz file. Returns None if the file does not exist or was extracted with
+        different parameters"""
+        if not os.path.isfile(path):
+            return None
+        try:
+            data = np.load(path)
+        except (OSError, ValueError):
+            return None
+        with data:
+            if int(data["version"]) != ROAD_GEOMETRY_VERSION:
+                return None
+            if float(data["precision"]) != precision:
+                return None
+            if float(data["tolerance"]) != tolerance:
+                return None
+            return cls(
+                samples=data["samples"],
+                markings=data["markings"],
+                offsets=data["offsets"],
+                kind=data["kind"],
+                side=data["side"],
+                road_id=data["road_id"],
+                lane_id=data["lane_id"],
+                lane_type=data["lane_type"],
+                is_junction=data["is_junction"],
+                precision=precision,
+                tolerance=tolerance,
+            )
+
+
+def get_geometry_parameters(tolerance=0.0, precision=0.05):
+    """Returns the parameters a road geometry cache is extracted with, which are part of its file name"""
+    return {
+        "version": ROAD_GEOMETRY_VERSION,
+        "precision": precision,
+        "tolerance": tolerance,
+    }
+
+
+def load_road_geometry(carla_map, path, precision=0.05, tolerance=0.0):
+    """Returns the geometry stored at path, extracting it from the map and storing it if needed"""
+    geometry = RoadGeometry.load(path, precision, tolerance)
+    if geometry is None:
+        geometry = RoadGeometry.extract(carla_map, precision, tolerance)
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        geometry.save(path)
+    return geometry
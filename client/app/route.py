@@ -0,0 +1,221 @@
+import numpy as np
+
+# Length of the part of the route ahead of the vehicle that is searched and
+# given to the controller, in meters. It covers the largest lookahead
+ROUTE_WINDOW_LENGTH = 50.0
+
+# Routes of up to this many points are followed faster as a plain array of
+# waypoints, the cost of updating the cursor is not paid back
+ROUTE_MIN_POINTS = 16
+
+
+class Route(object):
+    """Polyline followed by a vehicle. The cursor is the segment the vehicle is on, it only moves forward and is
+    searched for in a window of the segments ahead of it, so each update costs O(window) instead of O(route)"""
+
+    def __init__(self, waypoints, window_length=ROUTE_WINDOW_LENGTH):
+        if len(waypoints) > 0 and hasattr(waypoints[0], "x"):
+            waypoints = [(wp.x, wp.y) for wp in waypoints]
+        self.points = np.asarray(waypoints, dtype=np.float64).reshape(-1, 2)
+        self.window_length = window_length
+
+        # Arc length of the route at each point
+        self._delta = np.diff(self.points, axis=0)
+        segment_lengths = np.hypot(*self._delta.T)
+        self.arc_length = np.concatenate(([0.0], np.cumsum(segment_lengths)))
+
+        # Zero length segments project every location on their start
+        squared_lengths = segment_lengths**2
+        self._inverse_squared_lengths = np.divide(
+            1.0,
+            squared_lengths,
+            out=np.zeros_like(squared_lengths),
+            where=squared_lengths > 0,
+        )
+
+        self.cursor = 0
+        self.progress = 0.0
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def length(self):
+        """Arc length of the whole route, in meters"""
+        return self.arc_length[-1]
+
+    @property
+    def finished(self):
+        """Tells whether the vehicle reached the end of the route"""
+        return self.progress >= self.length
+
+    def _window_end(self):
+        """Returns the index after the last point of the window"""
+        ahead = max(self.arc_length[self.cursor], self.progress) + self.window_length
+        end = np.searchsorted(self.arc_length, ahead, "right")
+        return min(end + 1, len(self.points))
+
+    def window(self):
+        """Returns the points from the start of the cursor segment up to window_length meters ahead of the
+        progress"""
+        return self.points[self.cursor : self._window_end()]
+
+    def update(self, x, y):
+        """Moves the cursor to the closest segment of the window to a location and returns the progress, the arc
+        length of the projection of the location on the route. Only the segments up to the first local minimum of
+        the distance past the cursor are considered, so the cursor does not jump ahead to a later part of the
+        route that passes close to the location, as the way back of a hairpin does"""
+        if len(self.points) < 2:
+            return self.progress
+
+        end = self._window_end() - 1
+        start = self.points[self.cursor : end]
+        delta = self._delta[self.cursor : end]
+        offset_x = x - start[:, 0]
+        offset_y = y - start[:, 1]
+        t = (offset_x * delta[:, 0] + offset_y * delta[:, 1]) * (
+            self._inverse_squared_lengths[self.cursor : end]
+        )
+        t = np.clip(t, 0.0, 1.0)
+        error_x = offset_x - t * delta[:, 0]
+        error_y = offset_y - t * delta[:, 1]
+        distances = error_x * error_x + error_y * error_y
+
+        rising = np.flatnonzero(distances[1:] > distances[:-1])
+        segment = int(rising[0]) if len(rising) > 0 else len(distances) - 1
+        self.cursor += segment
+        self.progress = max(
+            self.progress,
+            self.arc_length[self.cursor]
+            + t[segment] * (self.arc_length[self.cursor + 1] - self.arc_length[self.cursor]),
+        )
+        return self.progress
+
+
+def _ranges(starts, counts):
+    """Returns, for consecutive ranges of integers given by their starts and lengths, the index of the range and
+    the value of every element"""
+    owner = np.repeat(np.arange(len(counts)), counts)
+    first = np.cumsum(counts) - counts
+    return owner, np.arange(owner.size) - first[owner] + starts[owner]
+
+
+class RouteBatch(object):
+    """Routes of several vehicles, concatenated so that the cursors of all of them are updated with array
+    operations. Each route behaves as a Route, cursors are indices in the concatenated points"""
+
+    def __init__(self, routes, window_length=ROUTE_WINDOW_LENGTH):
+        routes = [
+            route if isinstance(route, Route) else Route(route, window_length)
+            for route in routes
+        ]
+        if any(len(route) < 2 for route in routes):
+            raise ValueError("every route needs at least two points")
+        self.window_length = window_length
+        self.points = np.concatenate([route.points for route in routes]).reshape(-1, 2)
+
+        # Segments start at every point but the last one of each route
+        self._delta = np.concatenate(
+            [np.vstack((route._delta, (0.0, 0.0))) for route in routes]
+        )
+        self._inverse_squared_lengths = np.concatenate(
+            [np.append(route._inverse_squared_lengths, 0.0) for route in routes]
+        )
+
+        counts = np.array([len(route) for route in routes], dtype=np.int64)
+        self.first = np.cumsum(counts) - counts
+        self.last = self.first + counts - 1
+
+        # Arc lengths go on from one route to the next, so that all of them
+        # are searched at once
+        lengths = np.array([route.length for route in routes])
+        self.base = np.cumsum(lengths) - lengths
+        self.arc_length = np.concatenate(
+            [route.arc_length + base for route, base in zip(routes, self.base)]
+        )
+
+        self.cursor = self.first + np.array(
+            [route.cursor for route in routes], dtype=np.int64
+        )
+        self.progress = np.array([route.progress for route in routes])
+
+    def __len__(self):
+        return len(self.first)
+
+    def route(self, index):
+        """Returns a Route of one of the routes, at the same cursor and progress"""
+        points = self.points[self.first[index] : self.last[index] + 1]
+        route = Route(points, self.window_length)
+        route.cursor = int(self.cursor[index] - self.first[index])
+        route.progress = self.progress[index]
+        return route
+
+    def select(self, indices):
+        """Returns a batch of some of the routes, at the same cursors and progress"""
+        return RouteBatch([self.route(i) for i in indices], self.window_length)
+
+    @property
+    def length(self):
+        """Arc length of every route, in meters"""
+        return self.arc_length[self.last] - self.base
+
+    @property
+    def finished(self):
+        """Tells for every route whether its vehicle reached the end of it"""
+        return self.progress >= self.length
+
+    def _window_end(self, indices):
+        """Returns the index after the last point of the window of the given routes"""
+        cursor = self.cursor[indices]
+        ahead = np.maximum(
+            self.arc_length[cursor], self.progress[indices] + self.base[indices]
+        )
+        end = np.searchsorted(self.arc_length, ahead + self.window_length, "right")
+        return np.minimum(end + 1, self.last[indices] + 1)
+
+    def window(self, indices=None):
+        """Returns the route and the index of the points in the windows of the given routes, all of them by
+        default, grouped by route. Routes are numbered by their position in indices"""
+        if indices is None:
+            indices = np.arange(len(self))
+        cursor = self.cursor[indices]
+        return _ranges(cursor, self._window_end(indices) - cursor)
+
+    def update(self, x, y, indices=None):
+        """Moves the cursor of the given routes, all of them by default, to the closest segment of their window to
+        the location of their vehicle, up to the first local minimum of the distance past the cursor as
+        Route.update does, and returns the progress along them"""
+        if indices is None:
+            indices = np.arange(len(self))
+        cursor = self.cursor[indices]
+        counts = self._window_end(indices) - cursor - 1
+        owner, segment = _ranges(cursor, counts)
+
+        start = self.points[segment]
+        delta = self._delta[segment]
+        offset_x = np.asarray(x, dtype=np.float64)[owner] - start[:, 0]
+        offset_y = np.asarray(y, dtype=np.float64)[owner] - start[:, 1]
+        t = (offset_x * delta[:, 0] + offset_y * delta[:, 1]) * (
+            self._inverse_squared_lengths[segment]
+        )
+        t = np.clip(t, 0.0, 1.0)
+        error_x = offset_x - t * delta[:, 0]
+        error_y = offset_y - t * delta[:, 1]
+        distances = error_x * error_x + error_y * error_y
+
+        # First segment of every window followed by a farther one, or the
+        # last segment of the window
+        stop = np.ones(len(distances), dtype=bool)
+        stop[:-1] = (distances[1:] > distances[:-1]) | (owner[1:] != owner[:-1])
+        rows = np.flatnonzero(stop)
+        rows = rows[np.unique(owner[rows], return_index=True)[1]]
+
+        cursor = segment[rows]
+        self.cursor[indices] = cursor
+        self.progress[indices] = np.maximum(
+            self.progress[indices],
+            self.arc_length[cursor]
+            + t[rows] * (self.arc_length[cursor + 1] - self.arc_length[cursor])
+            - self.base[indices],
+        )
+        return self.progress[indices]
@@ -0,0 +1,71 @@
+import time
+import pygame
+
+# Pacing modes of the game loop
+FRAME_MODE_FPS = "fps"
+FRAME_MODE_SERVER = "server"
+FRAME_MODE_EVERY = "every"
+FRAME_MODES = (FRAME_MODE_FPS, FRAME_MODE_SERVER, FRAME_MODE_EVERY)
+
+# Target frame rate of the fps mode
+FRAME_SCHEDULER_FPS = 60
+
+# Longest wait for a frame of the simulation thread, so that the input is
+# still handled when the simulation stalls
+FRAME_WAIT_TIMEOUT = 0.1
+
+# Weight of the last frame in the smoothed loop utilization
+UTILIZATION_SMOOTHING = 0.05
+
+
+class FrameScheduler(object):
+    """Paces the game loop without busy waiting. In fps mode the loop sleeps out the rest of each frame period. In
+    server mode a frame is rendered for every simulation tick, as fast as the server goes, and in every mode only
+    one out of render_every ticks is rendered. Utilization is the share of wall time the loop spent working
+    instead of waiting"""
+
+    def __init__(self, mode=FRAME_MODE_FPS, fps=FRAME_SCHEDULER_FPS, render_every=1):
+        if mode not in FRAME_MODES:
+            raise ValueError("unknown frame mode %s" % mode)
+        if render_every < 1:
+            raise ValueError("render_every must be at least 1")
+        self.mode = mode
+        self.fps = fps
+        self.render_every = render_every if mode == FRAME_MODE_EVERY else 1
+        self.clock = pygame.time.Clock()
+        self.utilization = 0.0
+        self._last_rendered = None
+        self._wait_end = None
+
+    def next_frame_number(self):
+        """Returns the number of the next simulation frame that has to be rendered"""
+        if self._last_rendered is None:
+            return 0
+        return self._last_rendered + self.render_every
+
+    def wait(self, simulation=None):
+        """Waits until the next iteration of the game loop. Ticks of the synchronous loop are paced by the server
+        in server and every modes, so the loop only waits there when the simulation runs on its own thread"""
+        start = time.perf_counter()
+        if self.mode == FRAME_MODE_FPS:
+            self.clock.tick(self.fps)
+        else:
+            if simulation is not None:
+                simulation.wait_for_frame(self.next_frame_number(), FRAME_WAIT_TIMEOUT)
+            self.clock.tick()
+        end = time.perf_counter()
+
+        if self._wait_end is not None and end > self._wait_end:
+            busy = (start - self._wait_end) / (end - self._wait_end)
+            self.utilization += UTILIZATION_SMOOTHING * (busy - self.utilization)
+        self._wait_end = end
+
+    def should_render(self, frame):
+        """Tells whether the loop renders this iteration. Every iteration is rendered in fps mode, since the view
+        can change with the input even when the simulation does not"""
+        if self.mode == FRAME_MODE_FPS:
+            return True
+        if frame is None or frame.number < self.next_frame_number():
+            return False
+        self._last_rendered = frame.number
+        return True
@@ -0,0 +1,98 @@
+import time
+import logging
+import threading
+import collections
+
+import numpy as np
+
+
+class WorldFrame(
+    collections.namedtuple(
+        "WorldFrame",
+        (
+            "number",
+            "simulation_time",
+            "actor_state",
+            "spatial_index",
+            "actors_with_transforms",
+        ),
+    )
+):
+    """State of the world after a simulation tick. A frame and the arrays it holds are never modified once it is
+    built, so the render loop can read the latest frame while the next one is being built"""
+
+    __slots__ = ()
+
+    def find_transform(self, actor_id):
+        """Returns the transform of an actor in this frame, or None if it is not part of it"""
+        rows = np.flatnonzero(self.actor_state.ids == actor_id)
+        if len(rows) == 0:
+            return None
+        return self.actor_state.transforms[rows[0]]
+
+
+class SimulationThread(threading.Thread):
+    """Steps the simulation every fixed_delta_seconds of wall time, independently of the render loop. After each
+    step the hero and the fleet, if any, are ticked and the new frame is published, the render loop picks the
+    latest one with latest_frame. Errors raised while stepping stop the thread and are raised again by check"""
+
+    def __init__(self, world, hero, fleet=None):
+        super(SimulationThread, self).__init__(name="simulation", daemon=True)
+        self.world = world
+        self.hero = hero
+        self.fleet = fleet
+        self.latest_frame = None
+        self.error = None
+        self._stop_event = threading.Event()
+        self._published = threading.Condition()
+
+    def run(self):
+        period = self.world.fixed_delta_seconds
+        deadline = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                frame = self.world.step()
+                self.hero.tick(None)
+                if self.fleet is not None:
+                    self.fleet.tick(None, frame.actor_state)
+
+                # Publishing is a single reference assignment, so readers see
+                # either the previous frame or this one
+                with self._published:
+                    self.latest_frame = frame
+                    self._published.notify_all()
+
+                deadline += period
+                delay = deadline - time.monotonic()
+                if delay > 0.0:
+                    self._stop_event.wait(delay)
+                else:
+                    # Running behind, do not try to catch up
+                    deadline = time.monotonic()
+        except Exception as ex:
+            logging.exception("simulation thread stopped")
+            self.error = ex
+        finally:
+            with self._published:
+                self._published.notify_all()
+
+    def wait_for_frame(self, number, timeout=None):
+        """Waits until a frame with at least this number is published, the thread stops or timeout seconds pass"""
+        with self._published:
+            self._published.wait_for(
+                lambda: self.error is not None
+                or self._stop_event.is_set()
+                or (self.latest_frame is not None and self.latest_frame.number >= number),
+                timeout,
+            )
+
+    def check(self):
+        """Raises again the error that stopped the thread, if any"""
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """Asks the thread to stop after the current step and waits for it"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,116 @@
+import math
+import numpy as np
+
+# Side of the square cells of the grid, in meters
+SPATIAL_GRID_CELL_SIZE = 20.0
+
+
+def _cell_key(cx, cy):
+    """Packs the coordinates of a cell into a single integer, works for scalars and int64 arrays"""
+    return (cx << 32) | (cy & 0xFFFFFFFF)
+
+
+class SpatialGrid(object):
+    """Uniform grid over a set of 2D points, rebuilt every tick. Rows are the indices of the points in the arrays
+    the grid was built from, so the results can index the actor state store directly. Every point may carry an
+    integer label, such as the actor category, to restrict the queries"""
+
+    def __init__(self, cell_size=SPATIAL_GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.build(np.zeros(0), np.zeros(0))
+
+    def __len__(self):
+        return len(self.x)
+
+    def build(self, x, y, labels=None):
+        """Sorts the points by cell. Takes O(N log N) and no Python loop over the points"""
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.labels = labels
+        self._cells = dict()
+        self._order = np.zeros(0, dtype=np.int64)
+        if len(self.x) == 0:
+            self._bounds = None
+            return
+
+        cx = np.floor(self.x / self.cell_size).astype(np.int64)
+        cy = np.floor(self.y / self.cell_size).astype(np.int64)
+        keys = _cell_key(cx, cy)
+        self._order = np.argsort(keys, kind="stable")
+        unique, starts, counts = np.unique(
+            keys[self._order], return_index=True, return_counts=True
+        )
+        self._cells = dict(
+            zip(unique.tolist(), zip(starts.tolist(), (starts + counts).tolist()))
+        )
+        self._bounds = (cx.min(), cy.min(), cx.max(), cy.max())
+
+    def _candidates(self, left, top, right, bottom):
+        """Returns the rows of the points in the cells that overlap a rectangle in world coordinates"""
+        if self._bounds is None:
+            return self._order
+        min_cx, min_cy, max_cx, max_cy = self._bounds
+        first_x = max(min_cx, int(math.floor(left / self.cell_size)))
+        first_y = max(min_cy, int(math.floor(top / self.cell_size)))
+        last_x = min(max_cx, int(math.floor(right / self.cell_size)))
+        last_y = min(max_cy, int(math.floor(bottom / self.cell_size)))
+        if first_x > last_x or first_y > last_y:
+            return self._order[:0]
+
+        # Visiting more cells than there are occupied ones costs more than
+        # testing every point
+        if (last_x - first_x + 1) * (last_y - first_y + 1) >= len(self._cells):
+            return self._order
+
+        slices = []
+        for cx in range(first_x, last_x + 1):
+            for cy in range(first_y, last_y + 1):
+                cell = self._cells.get(_cell_key(cx, cy))
+                if cell is not None:
+                    slices.append(self._order[cell[0] : cell[1]])
+        if not slices:
+            return self._order[:0]
+        return np.concatenate(slices)
+
+    def _filter(self, rows, label):
+        if label is None or self.labels is None:
+            return rows
+        return rows[self.labels[rows] == label]
+
+    def query_rect(self, left, top, right, bottom, label=None):
+        """Returns, in increasing order, the rows of the points inside a rectangle in world coordinates"""
+        rows = self._filter(self._candidates(left, top, right, bottom), label)
+        x = self.x[rows]
+        y = self.y[rows]
+        inside = (x >= left) & (x <= right) & (y >= top) & (y <= bottom)
+        return np.sort(rows[inside])
+
+    def query_radius(self, x, y, radius, label=None):
+        """Returns the rows of the points within radius of a location, sorted by distance"""
+        rows = self._filter(
+            self._candidates(x - radius, y - radius, x + radius, y + radius), label
+        )
+        d = np.hypot(self.x[rows] - x, self.y[rows] - y)
+        inside = d <= radius
+        rows = rows[inside]
+        return rows[np.argsort(d[inside], kind="stable")]
+
+    def nearest(self, x, y, k, label=None, exclude=None):
+        """Returns the rows of the k points closest to a location, sorted by distance. Rows in exclude are skipped"""
+        if self._bounds is None or k <= 0:
+            return self._order[:0]
+
+        # Largest distance from the location to any point of the grid
+        min_cx, min_cy, max_cx, max_cy = self._bounds
+        far_x = max(abs(x - min_cx * self.cell_size), abs(x - (max_cx + 1) * self.cell_size))
+        far_y = max(abs(y - min_cy * self.cell_size), abs(y - (max_cy + 1) * self.cell_size))
+        max_radius = math.hypot(far_x, far_y)
+
+        radius = self.cell_size
+        while True:
+            rows = self.query_radius(x, y, radius, label)
+            if exclude is not None:
+                rows = rows[~np.isin(rows, exclude)]
+            if len(rows) >= k or radius >= max_radius:
+                return rows[:k]
+            radius *= 2.0
@@ -1,25 +1,57 @@
 import os
 import sys
 import random
+import functools
 import pygame
-import hashlib
 import carla
 import math
-import glob
 import logging
+import numpy as np
 
 from carla import TrafficLightState as tls
 
 from .color import *
+from .actor_registry import *
+from .actor_state import ActorStateStore
+from .spatial_index import SpatialGrid
+from .simulation import WorldFrame
+from .lru import LRUCache
+from .label_cache import LabelCache
+from .profiler import FrameProfiler
+from .map_tiles import *
+from .map_cache import *
+from .road_geometry import *
 
 PIXELS_PER_METER = 12
 HERO_DEFAULT_SCALE = 1.0
 PIXELS_AHEAD_VEHICLE = 150
 
+# Actors farther than this from the visible region of the map are not drawn,
+# in meters. It covers the largest actors, their labels and their triggers
+ACTOR_CULL_MARGIN = 10.0
+MAP_CACHE_DIR = os.path.join("cache", "no_rendering_mode")
 
-def get_actor_display_name(actor, truncate=250):
-    name = " ".join(actor.type_id.replace("_", ".").title().split(".")[1:])
-    return (name[: truncate - 1] + "\u2026") if len(name) > truncate else name
+# Traffic light sprites are rotated in steps of this many degrees, and the
+# sprites of this many angle and scale pairs are kept
+TRAFFIC_LIGHT_ANGLE_STEP = 1.0
+TRAFFIC_LIGHT_CACHE_SIZE = 128
+
+# Number of regions changed by the actors above which the result surface is
+# composited as a single region
+DIRTY_RECTS_LIMIT = 64
+
+# Largest distance, in pixels of the map, between the drawn roads and the
+# roads of the map. Zero samples the roads every 5 cm
+MAP_MAX_PIXEL_ERROR = 0.5
+
+# Number of processes rasterizing the map tiles when the client bakes a map
+# that is not cached. The client already holds the display, so it bakes
+# serially and the pool of one process per core is left to bake.py
+MAP_CLIENT_BAKE_WORKERS = 1
+
+# The hero view is shrunk by this factor so that its rotated square always
+# covers the round border
+HERO_VIEW_ZOOM = 0.9
 
 
 class Util(object):
@@ -98,15 +130,34 @@ class TrafficLightSurfaces(object):
         }
         self.surfaces = dict(self._original_surfaces)
 
+        # Rotated and scaled surfaces by quantized angle and scale
+        self._cache = LRUCache(TRAFFIC_LIGHT_CACHE_SIZE)
+        self._key = None
+
     def rotozoom(self, angle, scale):
-        """Rotates and scales the traffic light surface"""
-        for key, surface in self._original_surfaces.items():
-            self.surfaces[key] = pygame.transform.rotozoom(surface, angle, scale)
+        """Rotates and scales the traffic light surface. The angle is rounded to TRAFFIC_LIGHT_ANGLE_STEP degrees, so
+        the surfaces are only transformed again when the angle changes by more than that or the scale changes"""
+        steps = int(round(360.0 / TRAFFIC_LIGHT_ANGLE_STEP))
+        key = (int(round(angle / TRAFFIC_LIGHT_ANGLE_STEP)) % steps, scale)
+        if key == self._key:
+            return
+        self._key = key
+
+        surfaces = self._cache.get(key)
+        if surfaces is None:
+            angle = key[0] * TRAFFIC_LIGHT_ANGLE_STEP
+            surfaces = dict()
+            for state, surface in self._original_surfaces.items():
+                surfaces[state] = pygame.transform.rotozoom(surface, angle, scale)
+            self._cache.put(key, surfaces)
+        self.surfaces = surfaces
 
 
 class MapImage(object):
-    """Class encharged of rendering a 2D image from top view of a carla world. Please note that a cache system is used, so if the OpenDrive content
-    of a Carla town has not changed, it will read and use the stored image if it was rendered in a previous execution"""
+    """Class encharged of rendering a 2D image from top view of a carla world. The map is recorded in a canvas, baked
+    into a pyramid of tiles and only the visible tiles are shown. Please note that a cache system is used, so if the
+    OpenDrive content of a Carla town and the rendering parameters have not changed, it will read the tiles stored in
+    a previous execution"""
 
     def __init__(
         self,
@@ -116,6 +167,9 @@ class MapImage(object):
         show_triggers,
         show_connections,
         show_spawn_points,
+        cache_dir=MAP_CACHE_DIR,
+        workers=MAP_CLIENT_BAKE_WORKERS,
+        max_pixel_error=MAP_MAX_PIXEL_ERROR,
     ):
         """Renders the map image generated based on the world, its map and additional flags that provide extra information about the road network"""
         self._pixels_per_meter = pixels_per_meter
@@ -124,6 +178,89 @@ class MapImage(object):
         self.show_connections = show_connections
         self.show_spawn_points = show_spawn_points
 
+        # Roads are sampled so that they do not deviate more than the maximum
+        # error at the requested resolution
+        self.geometry_tolerance = max_pixel_error / float(pixels_per_meter)
+
+        # Get hash based on the OpenDrive content
+        opendrive_hash = get_opendrive_hash(carla_map)
+
+        # Parameters the cached map must have been baked with
+        parameters = {
+            "version": MAP_CACHE_VERSION,
+            "opendrive_hash": opendrive_hash,
+            "requested_pixels_per_meter": pixels_per_meter,
+            "show_triggers": show_triggers,
+            "show_connections": show_connections,
+            "show_spawn_points": show_spawn_points,
+            "max_pixel_error": max_pixel_error,
+            "tile_size": MAP_TILE_SIZE,
+            "levels": MAP_TILE_LEVELS,
+        }
+
+        # Build path for saving or loading the cached map tiles
+        town_name = carla_map.name.split("/")[-1]
+        cache_path = get_cache_path(cache_dir, town_name, opendrive_hash, parameters)
+
+        self.store = MapTileStore.open(cache_path, parameters)
+        if self.store is None:
+            # If folders path does not exist, create it
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            # Remove files if selected town had a previous version saved
+            remove_stale_caches(cache_dir, town_name, opendrive_hash)
+
+            # Render map from the road geometry, which is only extracted from the server if it is not cached
+            road_geometry = load_road_geometry(
+                carla_map,
+                get_geometry_path(
+                    cache_dir,
+                    town_name,
+                    opendrive_hash,
+                    get_geometry_parameters(self.geometry_tolerance),
+                ),
+                tolerance=self.geometry_tolerance,
+            )
+            canvas = self.record_road_map(carla_world, carla_map, road_geometry)
+
+            # Save baked tiles for next executions of same map
+            metadata = dict(parameters)
+            metadata.update(
+                {
+                    "town_name": town_name,
+                    "pixels_per_meter": self._pixels_per_meter,
+                    "world_offset": list(self._world_offset),
+                    "width": self.width,
+                    "width_in_pixels": self.width_in_pixels,
+                }
+            )
+            MapTileStore.write(
+                cache_path,
+                MapTilePyramid(self.width_in_pixels, canvas=canvas),
+                metadata,
+                workers,
+            )
+            self.store = MapTileStore.open(cache_path, parameters)
+
+        # The geometry of the map is read from the index, so a cached map needs no
+        # further requests to the server
+        index = self.store.index
+        self._pixels_per_meter = index["pixels_per_meter"]
+        self._world_offset = tuple(index["world_offset"])
+        self.width = index["width"]
+        self.width_in_pixels = index["width_in_pixels"]
+
+        self.tiles = MapTilePyramid(self.width_in_pixels, store=self.store)
+
+    def close(self):
+        """Releases the tile store"""
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def record_road_map(self, carla_world, carla_map, road_geometry):
+        """Computes the extent of the map and records the road map in a new canvas"""
         waypoints = carla_map.generate_waypoints(2)
         margin = 50
         max_x = (
@@ -151,62 +288,37 @@ class MapImage(object):
 
         # Adapt Pixels per meter to make world fit in surface
         surface_pixel_per_meter = int(width_in_pixels / self.width)
-        if surface_pixel_per_meter > PIXELS_PER_METER:
-            surface_pixel_per_meter = PIXELS_PER_METER
+        if surface_pixel_per_meter > self._pixels_per_meter:
+            surface_pixel_per_meter = self._pixels_per_meter
 
         self._pixels_per_meter = surface_pixel_per_meter
-        width_in_pixels = int(self._pixels_per_meter * self.width)
-
-        self.big_map_surface = pygame.Surface(
-            (width_in_pixels, width_in_pixels)
-        ).convert()
-
-        # Load OpenDrive content
-        opendrive_content = carla_map.to_opendrive()
-
-        # Get hash based on content
-        hash_func = hashlib.sha1()
-        hash_func.update(opendrive_content.encode("UTF-8"))
-        opendrive_hash = str(hash_func.hexdigest())
-
-        # Build path for saving or loading the cached rendered map
-        filename = carla_map.name.split("/")[-1] + "_" + opendrive_hash + ".tga"
-        dirname = os.path.join("cache", "no_rendering_mode")
-        full_path = str(os.path.join(dirname, filename))
-
-        if os.path.isfile(full_path):
-            # Load Image
-            self.big_map_surface = pygame.image.load(full_path)
-        else:
-            # Render map
-            self.draw_road_map(
-                self.big_map_surface,
-                carla_world,
-                carla_map,
-                self.world_to_pixel,
-                self.world_to_pixel_width,
-            )
-
-            # If folders path does not exist, create it
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-
-            # Remove files if selected town had a previous version saved
-            list_filenames = glob.glob(os.path.join(dirname, carla_map.name) + "*")
-            for town_filename in list_filenames:
-                os.remove(town_filename)
-
-            # Save rendered map for next executions of same map
-            pygame.image.save(self.big_map_surface, full_path)
-
-        self.surface = self.big_map_surface
+        self.width_in_pixels = int(self._pixels_per_meter * self.width)
+
+        canvas = MapCanvas(self.width_in_pixels)
+        self.draw_road_map(
+            canvas,
+            carla_world,
+            carla_map,
+            road_geometry,
+            self.world_to_pixel,
+            self.world_to_pixel_width,
+            self.world_to_pixel_array,
+        )
+        return canvas
 
     def draw_road_map(
-        self, map_surface, carla_world, carla_map, world_to_pixel, world_to_pixel_width
+        self,
+        map_surface,
+        carla_world,
+        carla_map,
+        road_geometry,
+        world_to_pixel,
+        world_to_pixel_width,
+        world_to_pixel_array,
     ):
-        """Draws all the roads, including lane markings, arrows and traffic signs"""
+        """Draws all the roads, including lane markings, arrows and traffic signs. The roads are drawn from the
+        arrays of the road geometry and the map surface is a MapCanvas that records the drawing commands"""
         map_surface.fill(COLOR_ALUMINIUM_4)
-        precision = 0.05
 
         def lane_marking_color_to_tango(lane_marking_color):
             """Maps the lane marking color enum specified in PythonAPI to a Tango Color"""
@@ -232,40 +344,34 @@ class MapImage(object):
         def draw_solid_line(surface, color, closed, points, width):
             """Draws solid lines in a surface given a set of points, width and color"""
             if len(points) >= 2:
-                pygame.draw.lines(surface, color, closed, points, width)
+                surface.lines(color, closed, points, width)
 
         def draw_broken_line(surface, color, closed, points, width):
-            """Draws broken lines in a surface given a set of points, width and color"""
-            # Select which lines are going to be rendered from the set of lines
-            broken_lines = [
-                x for n, x in enumerate(zip(*(iter(points),) * 20)) if n % 3 == 0
-            ]
+            """Draws broken lines in a surface given a set of world points, width and color. Dashes are 1 meter long
+            and start every 3 meters along the line"""
+            points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+            if len(points) < 2:
+                return
+            length = arc_length(points)[-1]
+            starts = np.arange(0.0, length - 0.95, 3.0)
 
             # Draw selected lines
-            for line in broken_lines:
-                pygame.draw.lines(surface, color, closed, line, width)
+            for line in polyline_intervals(points, starts, 0.95):
+                surface.lines(color, closed, world_to_pixel_array(line), width)
 
-        def get_lane_markings(lane_marking_type, lane_marking_color, waypoints, sign):
+        def get_lane_markings(lane_marking_type, lane_marking_color, samples, sign):
             """For multiple lane marking types (SolidSolid, BrokenSolid, SolidBroken and BrokenBroken), it converts them
-            as a combination of Broken and Solid lines"""
+            as a combination of Broken and Solid lines in world coordinates"""
             margin = 0.25
-            marking_1 = [
-                world_to_pixel(lateral_shift(w.transform, sign * w.lane_width * 0.5))
-                for w in waypoints
-            ]
+            marking_1 = lateral_shift_array(samples, sign * samples[:, SAMPLE_WIDTH] * 0.5)
             if lane_marking_type == carla.LaneMarkingType.Broken or (
                 lane_marking_type == carla.LaneMarkingType.Solid
             ):
                 return [(lane_marking_type, lane_marking_color, marking_1)]
             else:
-                marking_2 = [
-                    world_to_pixel(
-                        lateral_shift(
-                            w.transform, sign * (w.lane_width * 0.5 + margin * 2)
-                        )
-                    )
-                    for w in waypoints
-                ]
+                marking_2 = lateral_shift_array(
+                    samples, sign * (samples[:, SAMPLE_WIDTH] * 0.5 + margin * 2)
+                )
                 if lane_marking_type == carla.LaneMarkingType.SolidBroken:
                     return [
                         (carla.LaneMarkingType.Broken, lane_marking_color, marking_1),
@@ -289,36 +395,35 @@ class MapImage(object):
 
             return [(carla.LaneMarkingType.NONE, carla.LaneMarkingColor.Other, [])]
 
-        def draw_lane(surface, lane, color):
+        def draw_lane(surface, samples, color):
             """Renders a single lane in a surface and with a specified color"""
-            for side in lane:
-                lane_left_side = [
-                    lateral_shift(w.transform, -w.lane_width * 0.5) for w in side
-                ]
-                lane_right_side = [
-                    lateral_shift(w.transform, w.lane_width * 0.5) for w in side
-                ]
-
-                polygon = lane_left_side + [x for x in reversed(lane_right_side)]
-                polygon = [world_to_pixel(x) for x in polygon]
-
-                if len(polygon) > 2:
-                    pygame.draw.polygon(surface, color, polygon, 5)
-                    pygame.draw.polygon(surface, color, polygon)
-
-        def draw_lane_marking(surface, waypoints):
+            polygon = get_lane_polygon(samples)
+
+            if len(polygon) > 2:
+                surface.polygon(color, polygon, 5)
+                surface.polygon(color, polygon)
+
+        def draw_lane_marking(surface, markings, samples):
             """Draws the left and right side of lane markings"""
             # Left Side
-            draw_lane_marking_single_side(surface, waypoints[0], -1)
+            draw_lane_marking_single_side(
+                surface,
+                markings[:, MARKING_LEFT_TYPE : MARKING_LEFT_COLOR + 1],
+                samples,
+                -1,
+            )
 
             # Right Side
-            draw_lane_marking_single_side(surface, waypoints[1], 1)
-
-        def draw_lane_marking_single_side(surface, waypoints, sign):
-            """Draws the lane marking given a set of waypoints and decides whether drawing the right or left side of
-            the waypoint based on the sign parameter"""
-            lane_marking = None
+            draw_lane_marking_single_side(
+                surface,
+                markings[:, MARKING_RIGHT_TYPE : MARKING_RIGHT_COLOR + 1],
+                samples,
+                1,
+            )
 
+        def draw_lane_marking_single_side(surface, lane_markings, samples, sign):
+            """Draws the lane marking given the (N, 2) marking types and colors of one side of a lane and decides
+            whether drawing the right or left side of the samples based on the sign parameter"""
             marking_type = carla.LaneMarkingType.NONE
             previous_marking_type = carla.LaneMarkingType.NONE
 
@@ -328,23 +433,19 @@ class MapImage(object):
             markings_list = []
             temp_waypoints = []
             current_lane_marking = carla.LaneMarkingType.NONE
-            for sample in waypoints:
-                lane_marking = (
-                    sample.left_lane_marking if sign < 0 else sample.right_lane_marking
-                )
-
-                if lane_marking is None:
+            for index, (marking_type, marking_color) in enumerate(
+                lane_markings.tolist()
+            ):
+                # A negative type means the sample has no lane marking
+                if marking_type < 0:
                     continue
 
-                marking_type = lane_marking.type
-                marking_color = lane_marking.color
-
                 if current_lane_marking != marking_type:
                     # Get the list of lane markings to draw
                     markings = get_lane_markings(
                         previous_marking_type,
                         lane_marking_color_to_tango(previous_marking_color),
-                        temp_waypoints,
+                        samples[temp_waypoints],
                         sign,
                     )
                     current_lane_marking = marking_type
@@ -353,18 +454,19 @@ class MapImage(object):
                     for marking in markings:
                         markings_list.append(marking)
 
+                    # The new marking starts where the previous one ends, samples
+                    # may be meters apart so none of them is skipped
                     temp_waypoints = temp_waypoints[-1:]
 
-                else:
-                    temp_waypoints.append((sample))
-                    previous_marking_type = marking_type
-                    previous_marking_color = marking_color
+                temp_waypoints.append(index)
+                previous_marking_type = marking_type
+                previous_marking_color = marking_color
 
             # Add last marking
             last_markings = get_lane_markings(
                 previous_marking_type,
                 lane_marking_color_to_tango(previous_marking_color),
-                temp_waypoints,
+                samples[temp_waypoints],
                 sign,
             )
             for marking in last_markings:
@@ -373,7 +475,13 @@ class MapImage(object):
             # Once the lane markings have been simplified to Solid or Broken lines, we draw them
             for markings in markings_list:
                 if markings[0] == carla.LaneMarkingType.Solid:
-                    draw_solid_line(surface, markings[1], False, markings[2], 2)
+                    draw_solid_line(
+                        surface,
+                        markings[1],
+                        False,
+                        world_to_pixel_array(markings[2]),
+                        2,
+                    )
                 elif markings[0] == carla.LaneMarkingType.Broken:
                     draw_broken_line(surface, markings[1], False, markings[2], 2)
 
@@ -389,11 +497,8 @@ class MapImage(object):
             left = start + 0.8 * forward - 0.4 * right_dir
 
             # Draw lines
-            pygame.draw.lines(
-                surface, color, False, [world_to_pixel(x) for x in [start, end]], 4
-            )
-            pygame.draw.lines(
-                surface,
+            surface.lines(color, False, [world_to_pixel(x) for x in [start, end]], 4)
+            surface.lines(
                 color,
                 False,
                 [world_to_pixel(x) for x in [left, start, right]],
@@ -432,13 +537,13 @@ class MapImage(object):
             ]
 
             line_pixel = [world_to_pixel(p) for p in line]
-            pygame.draw.lines(surface, color, True, line_pixel, 2)
+            surface.lines(color, True, line_pixel, 2)
 
             # Draw bounding box of the stop trigger
             if self.show_triggers:
                 corners = Util.get_bounding_box(actor)
                 corners = [world_to_pixel(p) for p in corners]
-                pygame.draw.lines(surface, trigger_color, True, corners, 2)
+                surface.lines(trigger_color, True, corners, 2)
 
         # def draw_crosswalk(surface, transform=None, color=COLOR_ALUMINIUM_2):
         #     """Given two points A and B, draw white parallel lines from A to B"""
@@ -468,106 +573,74 @@ class MapImage(object):
         #                       center - width_offset + height_offset]
 
         #         list_point = [world_to_pixel(p) for p in list_point]
-        #         pygame.draw.polygon(surface, color, list_point)
+        #         surface.polygon(color, list_point)
         #         current_length += (line_width + space_between_lines) * 2
 
-        def lateral_shift(transform, shift):
-            """Makes a lateral shift of the forward vector of a transform"""
-            transform.rotation.yaw += 90
-            return transform.location + shift * transform.get_forward_vector()
-
-        def draw_topology(carla_topology, index):
-            """Draws traffic signs and the roads network with sidewalks, parking and shoulders by generating waypoints"""
-            topology = [x[index] for x in carla_topology]
-            topology = sorted(topology, key=lambda w: w.transform.location.z)
-            set_waypoints = []
-            for waypoint in topology:
-                waypoints = [waypoint]
-
-                # Generate waypoints of a road id. Stop when road id differs
-                nxt = waypoint.next(precision)
-                if len(nxt) > 0:
-                    nxt = nxt[0]
-                    while nxt.road_id == waypoint.road_id:
-                        waypoints.append(nxt)
-                        nxt = nxt.next(precision)
-                        if len(nxt) > 0:
-                            nxt = nxt[0]
-                        else:
-                            break
-                set_waypoints.append(waypoints)
-
-                # Draw Shoulders, Parkings and Sidewalks
-                PARKING_COLOR = COLOR_ALUMINIUM_4_5
-                SHOULDER_COLOR = COLOR_ALUMINIUM_5
-                SIDEWALK_COLOR = COLOR_ALUMINIUM_3
-
-                shoulder = [[], []]
-                parking = [[], []]
-                sidewalk = [[], []]
-
-                for w in waypoints:
-                    # Classify lane types until there are no waypoints by going left
-                    l = w.get_left_lane()
-                    while l and l.lane_type != carla.LaneType.Driving:
-
-                        if l.lane_type == carla.LaneType.Shoulder:
-                            shoulder[0].append(l)
-
-                        if l.lane_type == carla.LaneType.Parking:
-                            parking[0].append(l)
-
-                        if l.lane_type == carla.LaneType.Sidewalk:
-                            sidewalk[0].append(l)
-
-                        l = l.get_left_lane()
-
-                    # Classify lane types until there are no waypoints by going right
-                    r = w.get_right_lane()
-                    while r and r.lane_type != carla.LaneType.Driving:
-
-                        if r.lane_type == carla.LaneType.Shoulder:
-                            shoulder[1].append(r)
-
-                        if r.lane_type == carla.LaneType.Parking:
-                            parking[1].append(r)
-
-                        if r.lane_type == carla.LaneType.Sidewalk:
-                            sidewalk[1].append(r)
-
-                        r = r.get_right_lane()
-
-                # Draw classified lane types
-                draw_lane(map_surface, shoulder, SHOULDER_COLOR)
-                draw_lane(map_surface, parking, PARKING_COLOR)
-                draw_lane(map_surface, sidewalk, SIDEWALK_COLOR)
+        def lateral_shift_array(samples, shift):
+            """Makes a lateral shift of the forward vector of every sample, returns an (N, 2) array of locations"""
+            yaw = np.radians(samples[:, SAMPLE_YAW] + 90)
+            shift = shift * np.cos(np.radians(samples[:, SAMPLE_PITCH]))
+            return np.stack(
+                (
+                    samples[:, SAMPLE_X] + shift * np.cos(yaw),
+                    samples[:, SAMPLE_Y] + shift * np.sin(yaw),
+                ),
+                axis=-1,
+            )
 
-            # Draw Roads
-            for waypoints in set_waypoints:
-                waypoint = waypoints[0]
-                road_left_side = [
-                    lateral_shift(w.transform, -w.lane_width * 0.5) for w in waypoints
-                ]
-                road_right_side = [
-                    lateral_shift(w.transform, w.lane_width * 0.5) for w in waypoints
-                ]
+        def get_lane_polygon(samples):
+            """Returns the pixel polygon that covers a lane given by its samples"""
+            half_width = samples[:, SAMPLE_WIDTH] * 0.5
+            polygon = np.concatenate(
+                (
+                    lateral_shift_array(samples, -half_width),
+                    lateral_shift_array(samples, half_width)[::-1],
+                )
+            )
+            return world_to_pixel_array(polygon)
+
+        def draw_topology(geometry):
+            """Draws the roads network with sidewalks, parking and shoulders from the lane polylines of the road
+            geometry, which are stored in drawing order"""
+            lane_colors = {
+                LANE_SHOULDER: COLOR_ALUMINIUM_5,
+                LANE_PARKING: COLOR_ALUMINIUM_4_5,
+                LANE_SIDEWALK: COLOR_ALUMINIUM_3,
+            }
+            for index in range(len(geometry)):
+                samples = geometry.polyline(index).astype(np.float64)
+                kind = geometry.kind[index]
 
-                polygon = road_left_side + [x for x in reversed(road_right_side)]
-                polygon = [world_to_pixel(x) for x in polygon]
+                # Draw Shoulders, Parkings and Sidewalks
+                if kind != LANE_ROAD:
+                    draw_lane(map_surface, samples, lane_colors[kind])
+                    continue
 
-                if len(polygon) > 2:
-                    pygame.draw.polygon(map_surface, COLOR_ALUMINIUM_5, polygon, 5)
-                    pygame.draw.polygon(map_surface, COLOR_ALUMINIUM_5, polygon)
+                # Draw Roads
+                draw_lane(map_surface, samples, COLOR_ALUMINIUM_5)
 
                 # Draw Lane Markings and Arrows
-                if not waypoint.is_junction:
-                    draw_lane_marking(map_surface, [waypoints, waypoints])
-                    for n, wp in enumerate(waypoints):
-                        if ((n + 1) % 400) == 0:
-                            draw_arrow(map_surface, wp.transform)
+                if not geometry.is_junction[index]:
+                    draw_lane_marking(
+                        map_surface, geometry.polyline_markings(index), samples
+                    )
+                    # Arrows every 20 meters, interpolating the samples around them
+                    length = arc_length(samples[:, SAMPLE_X : SAMPLE_Y + 1])[-1]
+                    distances = np.arange(19.95, length, 20.0)
+                    poses = samples[:, : SAMPLE_PITCH + 1].copy()
+                    poses[:, SAMPLE_YAW] = np.degrees(
+                        np.unwrap(np.radians(poses[:, SAMPLE_YAW]))
+                    )
+                    arrows = interpolate_polyline(poses, distances)
+                    for x, y, z, yaw, pitch in arrows.tolist():
+                        draw_arrow(
+                            map_surface,
+                            carla.Transform(
+                                carla.Location(x, y, z), carla.Rotation(pitch, yaw, 0)
+                            ),
+                        )
 
-        topology = carla_map.get_topology()
-        draw_topology(topology, 0)
+        draw_topology(road_geometry)
 
         if self.show_spawn_points:
             for sp in carla_map.get_spawn_points():
@@ -582,15 +655,15 @@ class MapImage(object):
             for wp in carla_map.generate_waypoints(dist):
                 col = (0, 255, 255) if wp.is_junction else (0, 255, 0)
                 for nxt in wp.next(dist):
-                    pygame.draw.line(map_surface, col, to_pixel(wp), to_pixel(nxt), 2)
+                    map_surface.line(col, to_pixel(wp), to_pixel(nxt), 2)
                 if wp.lane_change & carla.LaneChange.Right:
                     r = wp.get_right_lane()
                     if r and r.lane_type == carla.LaneType.Driving:
-                        pygame.draw.line(map_surface, col, to_pixel(wp), to_pixel(r), 2)
+                        map_surface.line(col, to_pixel(wp), to_pixel(r), 2)
                 if wp.lane_change & carla.LaneChange.Left:
                     l = wp.get_left_lane()
                     if l and l.lane_type == carla.LaneType.Driving:
-                        pygame.draw.line(map_surface, col, to_pixel(wp), to_pixel(l), 2)
+                        map_surface.line(col, to_pixel(wp), to_pixel(l), 2)
 
         actors = carla_world.get_actors()
 
@@ -632,18 +705,36 @@ class MapImage(object):
         y = self.scale * self._pixels_per_meter * (location.y - self._world_offset[1])
         return [int(x - offset[0]), int(y - offset[1])]
 
+    def world_to_pixel_array(self, points, offset=(0, 0)):
+        """Converts an array of world coordinates of shape (..., 2) or (..., 3) to an int32 array of pixel
+        coordinates of shape (..., 2). It is the batched version of world_to_pixel"""
+        points = np.asarray(points, dtype=np.float64)
+        factor = self.scale * self._pixels_per_meter
+        pixels = np.empty(points.shape[:-1] + (2,), dtype=np.float64)
+        pixels[..., 0] = factor * (points[..., 0] - self._world_offset[0]) - offset[0]
+        pixels[..., 1] = factor * (points[..., 1] - self._world_offset[1]) - offset[1]
+        return pixels.astype(np.int32)
+
+    def pixel_to_world(self, pixel):
+        """Converts pixel coordinates of the scaled map to world coordinates"""
+        factor = self.scale * self._pixels_per_meter
+        return (
+            pixel[0] / factor + self._world_offset[0],
+            pixel[1] / factor + self._world_offset[1],
+        )
+
     def world_to_pixel_width(self, width):
         """Converts the world units to pixel units"""
         return int(self.scale * self._pixels_per_meter * width)
 
     def scale_map(self, scale):
-        """Scales the map surface"""
-        if scale != self.scale:
-            self.scale = scale
-            width = int(self.big_map_surface.get_width() * self.scale)
-            self.surface = pygame.transform.smoothscale(
-                self.big_map_surface, (width, width)
-            )
+        """Scales the map. Tiles are rescaled lazily when they become visible"""
+        self.scale = scale
+
+    def blit_visible(self, destination, rect, offset=(0, 0)):
+        """Blits the tiles of the scaled map that intersect rect into destination, whose top left corner is the
+        pixel offset of the scaled map"""
+        self.tiles.blit_visible(destination, self.scale, rect, offset)
 
 
 class World(object):
@@ -654,13 +745,27 @@ class World(object):
         self.args = args
         self.fixed_delta_seconds = 0.04
         self.simulation_time = 0
+        self._frame_number = 0
         self.server_clock = pygame.time.Clock()
         self.traffic_manager = None
 
-        # World data
+        # World data, the frame is the state of the last tick that is rendered
         self.world = None
         self.town_map = None
+        self.frame = None
         self.actors_with_transforms = []
+        self.actor_state = ActorStateStore()
+
+        # When enabled, actor states are read from a single world snapshot per
+        # tick instead of querying every actor for its transform
+        self.use_snapshot = not getattr(args, "legacy_tick", False)
+
+        # Static information of the actors, classified once by actor id
+        self.actor_registry = ActorRegistry()
+
+        # Grid over the locations of the actors, rebuilt every tick. Its rows
+        # are the rows of the actor state store and its labels their categories
+        self.spatial_index = SpatialGrid()
 
         self._input = None
 
@@ -679,8 +784,17 @@ class World(object):
         self.vehicle_id_surface = None
         self.result_surface = None
 
+        # Rects drawn on the actor surfaces in the previous frame, and view the
+        # result surface was composited for
+        self._actor_rects = []
+        self._id_rects = []
+        self._composited_view = None
+        self._hero_view_surface = None
+
         self.traffic_light_surfaces = TrafficLightSurfaces()
+        self.label_cache = LabelCache()
         self.affected_traffic_light = None
+        self.profiler = FrameProfiler()
 
         # Map info
         self.map_image = None
@@ -690,6 +804,7 @@ class World(object):
         self.actors_surface = None
         self.show_actor_ids = False
         self.actor_waypoints = dict()
+        self.actor_waypoint_bounds = dict()
 
     def _get_data_from_carla(self):
         """Retrieves the data from the server side"""
@@ -711,7 +826,7 @@ class World(object):
             pygame.quit()
             sys.exit()
 
-    def start(self, input_control):
+    def start(self, input_control, profiler=None):
         """Build the map image, stores the needed modules and prepares rendering in Hero Mode"""
         self.world, self.town_map = self._get_data_from_carla()
 
@@ -726,27 +841,20 @@ class World(object):
             show_triggers=False,
             show_connections=False,
             show_spawn_points=False,
+            cache_dir=getattr(self.args, "cache_dir", MAP_CACHE_DIR),
+            max_pixel_error=getattr(self.args, "max_pixel_error", MAP_MAX_PIXEL_ERROR),
         )
 
         self._input = input_control
+        if profiler is not None:
+            self.profiler = profiler
 
         self.original_surface_size = min(self.dim[0], self.dim[1])
-        self.surface_size = self.map_image.big_map_surface.get_width()
+        self.surface_size = self.map_image.width_in_pixels
 
         self.scaled_size = int(self.surface_size)
         self.prev_scaled_size = int(self.surface_size)
 
-        # Render Actors
-        self.actors_surface = pygame.Surface(
-            (self.map_image.surface.get_width(), self.map_image.surface.get_height())
-        )
-        self.actors_surface.set_colorkey(COLOR_BLACK)
-
-        self.vehicle_id_surface = pygame.Surface(
-            (self.surface_size, self.surface_size)
-        ).convert()
-        self.vehicle_id_surface.set_colorkey(COLOR_BLACK)
-
         self.border_round_surface = pygame.Surface(self.dim, pygame.SRCALPHA).convert()
         self.border_round_surface.set_colorkey(COLOR_WHITE)
         self.border_round_surface.fill(COLOR_BLACK)
@@ -766,27 +874,48 @@ class World(object):
             int((self.dim[1] - 8) / 2),
         )
 
-        scaled_original_size = self.original_surface_size * (1.0 / 0.9)
+        scaled_original_size = self.original_surface_size * (1.0 / HERO_VIEW_ZOOM)
         self.hero_surface = pygame.Surface(
             (scaled_original_size, scaled_original_size)
         ).convert()
-
-        self.result_surface = pygame.Surface(
-            (self.surface_size, self.surface_size)
+        hero_view_size = int(self.hero_surface.get_width() * HERO_VIEW_ZOOM)
+        self._hero_view_surface = pygame.Surface(
+            (hero_view_size, hero_view_size)
         ).convert()
+
+        # Actors are drawn and composited on surfaces that cover the visible
+        # region only, whose top left corner is the one of the clipping rect,
+        # so their size does not depend on the size of the map
+        view_size = (
+            max(self.dim[0], self.hero_surface.get_width()),
+            max(self.dim[1], self.hero_surface.get_height()),
+        )
+        self.actors_surface = pygame.Surface(view_size)
+        self.actors_surface.set_colorkey(COLOR_BLACK)
+
+        self.vehicle_id_surface = pygame.Surface(view_size).convert()
+        self.vehicle_id_surface.set_colorkey(COLOR_BLACK)
+
+        self.result_surface = pygame.Surface(view_size).convert()
         self.result_surface.set_colorkey(COLOR_BLACK)
 
         self._input.wheel_offset = HERO_DEFAULT_SCALE
 
         self.traffic_manager = self.client.get_trafficmanager(port=self.args.tm_port)
 
+    def start_headless(self):
+        """Connects to the server without building the map image or any surface. Nothing is rendered, the world is
+        only stepped, as fast as the server goes since it runs in synchronous mode"""
+        self.world, self.town_map = self._get_data_from_carla()
+        self.traffic_manager = self.client.get_trafficmanager(port=self.args.tm_port)
+
+        # The traffic manager has to wait for every tick, otherwise autopilot
+        # vehicles fall behind when the world is stepped faster than real time
+        self.traffic_manager.set_synchronous_mode(True)
+
     def select_hero_actor(self):
         """Selects only one hero actor if there are more than one. If there are not any, it will spawn one."""
-        hero_vehicles = [
-            actor
-            for actor in self.world.get_actors()
-            if "vehicle" in actor.type_id and actor.attributes["role_name"] == "hero"
-        ]
+        hero_vehicles = [info.actor for info in self.actor_registry if info.is_hero]
         if len(hero_vehicles) > 0:
             self.hero_actor = random.choice(hero_vehicles)
             self.hero_transform = self.hero_actor.get_transform()
@@ -818,223 +947,379 @@ class World(object):
 
         return actor
 
-    def tick(self, clock):
-        """Retrieves the actors for Hero and Map modes and updates de HUD based on that"""
+    def _read_actors_legacy(self):
+        """Retrieves the actors and queries the transform of each one of them, and the velocity of the vehicles and
+        walkers"""
         actors = self.world.get_actors()
+        infos = [self.actor_registry.register(actor) for actor in actors]
+        self.actor_registry.retain(set(info.id for info in infos))
 
         # We store the transforms also so that we avoid having transforms of
         # previous tick and current tick when rendering them.
-        self.actors_with_transforms = [
-            (actor, actor.get_transform()) for actor in actors
-        ]
-        if self.hero_actor is not None:
-            self.hero_transform = self.hero_actor.get_transform()
+        transforms = [info.actor.get_transform() for info in infos]
+        actor_velocities = {
+            info.id: info.actor.get_velocity()
+            for info in infos
+            if info.category in (ACTOR_VEHICLE, ACTOR_WALKER)
+        }
+        return infos, transforms, actor_velocities
+
+    def _read_actors_snapshot(self):
+        """Builds the actor transforms and velocities from a single world snapshot. Actor handles are only
+        requested for actors that were not seen in a previous tick"""
+        snapshot = self.world.get_snapshot()
+
+        new_ids = [s.id for s in snapshot if s.id not in self.actor_registry]
+        if len(new_ids) > 0:
+            for actor in self.world.get_actors(new_ids):
+                self.actor_registry.register(actor)
+
+        infos = []
+        transforms = []
+        actor_velocities = dict()
+        for actor_snapshot in snapshot:
+            info = self.actor_registry.get(actor_snapshot.id)
+            if info is None:
+                continue
+            infos.append(info)
+            transforms.append(actor_snapshot.get_transform())
+            actor_velocities[actor_snapshot.id] = actor_snapshot.get_velocity()
+
+        # Forget the actors that left the world
+        self.actor_registry.retain(set(info.id for info in infos))
+        return infos, transforms, actor_velocities
+
+    def toggle_snapshot(self):
+        """Switches between the snapshot and the per actor query paths used in tick"""
+        self.use_snapshot = not self.use_snapshot
+        return self.use_snapshot
+
+    def step(self):
+        """Reads the actors of the current tick into a new frame and advances the simulation by one tick. It does
+        not modify anything the render reads, so it can run on its own thread"""
+        if self.use_snapshot:
+            infos, transforms, actor_velocities = self._read_actors_snapshot()
+        else:
+            infos, transforms, actor_velocities = self._read_actors_legacy()
+
+        actor_state = ActorStateStore()
+        actor_state.update(infos, transforms, actor_velocities)
+        spatial_index = SpatialGrid()
+        spatial_index.build(actor_state.x, actor_state.y, actor_state.category)
+
+        self._frame_number += 1
+        frame = WorldFrame(
+            number=self._frame_number,
+            simulation_time=self._frame_number * self.fixed_delta_seconds,
+            actor_state=actor_state,
+            spatial_index=spatial_index,
+            actors_with_transforms=[
+                (info.actor, transform) for info, transform in zip(infos, transforms)
+            ],
+        )
 
-        # world_snapshot = self.world.get_snapshot()
-        # print(world_snapshot.timestamp)
-        self.simulation_time += self.fixed_delta_seconds
         self.world.tick()
+        return frame
 
-    def _split_actors(self):
-        """Splits the retrieved actors by type id"""
-        vehicles = []
-        traffic_lights = []
-        speed_limits = []
-        walkers = []
-
-        for actor_with_transform in self.actors_with_transforms:
-            actor = actor_with_transform[0]
-            if "vehicle" in actor.type_id:
-                vehicles.append(actor_with_transform)
-            elif "traffic_light" in actor.type_id:
-                traffic_lights.append(actor_with_transform)
-            elif "speed_limit" in actor.type_id:
-                speed_limits.append(actor_with_transform)
-            elif "walker.pedestrian" in actor.type_id:
-                walkers.append(actor_with_transform)
-
-        return (vehicles, traffic_lights, speed_limits, walkers)
-
-    def _render_traffic_lights(self, surface, list_tl, world_to_pixel):
-        """Renders the traffic lights and shows its triggers and bounding boxes if flags are enabled"""
-        self.affected_traffic_light = None
+    def apply_frame(self, frame):
+        """Makes a frame the state that is rendered and shown in the HUD"""
+        if frame is None or frame is self.frame:
+            return
+        self.frame = frame
+        self.simulation_time = frame.simulation_time
+        self.actor_state = frame.actor_state
+        self.spatial_index = frame.spatial_index
+        self.actors_with_transforms = frame.actors_with_transforms
+
+        # The hero keeps the transform it was selected with until it is part
+        # of a frame
+        if self.hero_actor is not None:
+            hero_transform = frame.find_transform(self.hero_actor.id)
+            if hero_transform is not None:
+                self.hero_transform = hero_transform
 
-        for tl in list_tl:
-            world_pos = tl.get_location()
-            pos = world_to_pixel(world_pos)
+    def tick(self, clock):
+        """Retrieves the actors for Hero and Map modes and updates de HUD based on that"""
+        self.apply_frame(self.step())
+
+    def get_nearby_actors(self, location, radius, category=None):
+        """Returns the rows of the actor state store of the actors within radius of a location, sorted by distance.
+        Category restricts the search to the actors of one category"""
+        return self.spatial_index.query_radius(location.x, location.y, radius, category)
+
+    def get_nearest_actors(self, location, k, category=None, exclude_id=None):
+        """Returns the rows of the actor state store of the k actors closest to a location, sorted by distance"""
+        exclude = None
+        if exclude_id is not None:
+            exclude = np.flatnonzero(self.actor_state.ids == exclude_id)
+        return self.spatial_index.nearest(
+            location.x, location.y, k, category, exclude
+        )
 
-            if self.hero_actor is not None:
-                corners = Util.get_bounding_box(tl)
-                corners = [world_to_pixel(p) for p in corners]
-                tl_t = tl.get_transform()
+    def _find_affected_traffic_lights(self):
+        """Returns the rows of the traffic lights whose trigger volume reaches the hero vehicle. The last one is kept
+        as the affected traffic light"""
+        self.affected_traffic_light = None
+        affected = set()
+        if self.hero_actor is None:
+            return affected
 
-                transformed_tv = tl_t.transform(tl.trigger_volume.location)
-                hero_location = self.hero_actor.get_location()
-                d = hero_location.distance(transformed_tv)
-                s = Util.length(tl.trigger_volume.extent) + Util.length(
-                    self.hero_actor.bounding_box.extent
-                )
-                if d <= s:
-                    # Highlight traffic light
-                    self.affected_traffic_light = tl
-                    srf = self.traffic_light_surfaces.surfaces["h"]
-                    surface.blit(srf, srf.get_rect(center=pos))
+        hero_info = self.actor_registry.get(self.hero_actor.id)
+        if hero_info is not None:
+            hero_length = math.sqrt(sum(x**2 for x in hero_info.extent))
+        else:
+            hero_length = Util.length(self.hero_actor.bounding_box.extent)
+
+        # Only the traffic lights that may reach the hero are checked
+        hero_location = self.hero_transform.location
+        reach = self.actor_state.reach[self.actor_state.category == ACTOR_TRAFFIC_LIGHT]
+        if len(reach) == 0:
+            return affected
+        list_tl = self.get_nearby_actors(
+            hero_location, reach.max() + hero_length, ACTOR_TRAFFIC_LIGHT
+        )
+        for i in np.sort(list_tl).tolist():
+            info = self.actor_state.infos[i]
+            tl_t = self.actor_state.transforms[i]
+            transformed_tv = tl_t.transform(info.trigger_volume.location)
+            d = hero_location.distance(transformed_tv)
+            s = math.sqrt(sum(x**2 for x in info.extent)) + hero_length
+            if d <= s:
+                self.affected_traffic_light = info.actor
+                affected.add(i)
+        return affected
+
+    def _render_traffic_lights(self, surface, list_tl, world_to_pixel_array, affected):
+        """Renders the traffic lights and highlights the ones affecting the hero vehicle. Returns the drawn rects"""
+        rects = []
+        positions = world_to_pixel_array(self.actor_state.locations(list_tl))
+        for i, pos in zip(list_tl, positions.tolist()):
+            tl = self.actor_state.infos[i].actor
+
+            if i in affected:
+                # Highlight traffic light
+                srf = self.traffic_light_surfaces.surfaces["h"]
+                rects.append(surface.blit(srf, srf.get_rect(center=pos)))
 
             srf = self.traffic_light_surfaces.surfaces[tl.state]
-            surface.blit(srf, srf.get_rect(center=pos))
+            rects.append(surface.blit(srf, srf.get_rect(center=pos)))
+        return rects
 
     def _render_speed_limits(
-        self, surface, list_sl, world_to_pixel, world_to_pixel_width
+        self, surface, list_sl, world_to_pixel_array, world_to_pixel_width
     ):
         """Renders the speed limits by drawing two concentric circles (outer is red and inner white) and a speed limit text"""
-
+        rects = []
         font_size = world_to_pixel_width(2)
         radius = world_to_pixel_width(2)
-        font = pygame.font.SysFont("Arial", font_size)
 
-        for sl in list_sl:
-
-            x, y = world_to_pixel(sl.get_location())
+        positions = world_to_pixel_array(self.actor_state.locations(list_sl))
+        for i, (x, y) in zip(list_sl, positions.tolist()):
+            info = self.actor_state.infos[i]
 
             # Render speed limit concentric circles
             white_circle_radius = int(radius * 0.75)
 
-            pygame.draw.circle(surface, COLOR_SCARLET_RED_1, (x, y), radius)
+            rects.append(
+                pygame.draw.circle(surface, COLOR_SCARLET_RED_1, (x, y), radius)
+            )
             pygame.draw.circle(surface, COLOR_ALUMINIUM_0, (x, y), white_circle_radius)
 
-            limit = sl.type_id.split(".")[2]
-            font_surface = font.render(limit, True, COLOR_ALUMINIUM_5)
-
             # Blit
             if self.hero_actor is not None:
                 # In hero mode, Rotate font surface with respect to hero vehicle front
                 angle = -self.hero_transform.rotation.yaw - 90.0
-                font_surface = pygame.transform.rotate(font_surface, angle)
+                font_surface = self.label_cache.render(
+                    info.label, COLOR_ALUMINIUM_5, font_size, angle, "Arial"
+                )
                 offset = font_surface.get_rect(center=(x, y))
-                surface.blit(font_surface, offset)
+                rects.append(surface.blit(font_surface, offset))
 
             else:
                 # In map mode, there is no need to rotate the text of the speed limit
-                surface.blit(font_surface, (x - radius / 2, y - radius / 2))
+                font_surface = self.label_cache.render(
+                    info.label, COLOR_ALUMINIUM_5, font_size, name="Arial"
+                )
+                rects.append(
+                    surface.blit(font_surface, (x - radius / 2, y - radius / 2))
+                )
+        return rects
 
-    def _render_walkers(self, surface, list_w, world_to_pixel):
+    def _render_walkers(self, surface, list_w, world_to_pixel_array):
         """Renders the walkers' bounding boxes"""
-        for w in list_w:
-            color = COLOR_PLUM_0
-
-            # Compute bounding box points
-            bb = w[0].bounding_box.extent
-            corners = [
-                carla.Location(x=-bb.x, y=-bb.y),
-                carla.Location(x=bb.x, y=-bb.y),
-                carla.Location(x=bb.x, y=bb.y),
-                carla.Location(x=-bb.x, y=bb.y),
-            ]
-
-            w[1].transform(corners)
-            corners = [world_to_pixel(p) for p in corners]
-            pygame.draw.polygon(surface, color, corners)
+        if len(list_w) == 0:
+            return []
+
+        # Compute bounding box points of all the walkers at once
+        corners = world_to_pixel_array(self.actor_state.walker_corners(list_w))
+        return [
+            pygame.draw.polygon(surface, self.actor_state.infos[i].color, points)
+            for i, points in zip(list_w, corners.tolist())
+        ]
 
-    def _render_vehicles(self, surface, list_v, world_to_pixel):
+    def _render_vehicles(self, surface, list_v, world_to_pixel_array):
         """Renders the vehicles' bounding boxes"""
-        for v in list_v:
-            color = COLOR_SKY_BLUE_0
-            if int(v[0].attributes["number_of_wheels"]) == 2:
-                color = COLOR_CHOCOLATE_1
-            if v[0].attributes["role_name"] == "hero":
-                color = COLOR_CHAMELEON_0
-            # Compute bounding box points
-            bb = v[0].bounding_box.extent
-            corners = [
-                carla.Location(x=-bb.x, y=-bb.y),
-                carla.Location(x=bb.x - 0.8, y=-bb.y),
-                carla.Location(x=bb.x, y=0),
-                carla.Location(x=bb.x - 0.8, y=bb.y),
-                carla.Location(x=-bb.x, y=bb.y),
-                carla.Location(x=-bb.x, y=-bb.y),
-            ]
-            v[1].transform(corners)
-            corners = [world_to_pixel(p) for p in corners]
-            pygame.draw.lines(
-                surface,
-                color,
-                False,
-                corners,
-                int(math.ceil(4.0 * self.map_image.scale)),
-            )
-
-            # Draw waypoints for vehicle
-            if v[0].id in self.actor_waypoints:
-                points = [world_to_pixel(p) for p in self.actor_waypoints[v[0].id]]
-                pygame.draw.lines(
-                    surface,
-                    (255, 0, 0),
-                    False,
-                    points,
-                    int(math.ceil(2.0 * self.map_image.scale)),
-                )
+        if len(list_v) == 0:
+            return []
+
+        rects = []
+
+        # Compute bounding box points of all the vehicles at once
+        corners = world_to_pixel_array(self.actor_state.vehicle_corners(list_v))
+        width = int(math.ceil(4.0 * self.map_image.scale))
+        for i, points in zip(list_v, corners.tolist()):
+            info = self.actor_state.infos[i]
+            rects.append(pygame.draw.lines(surface, info.color, False, points, width))
+        return rects
+
+    def _render_routes(self, surface, actor_ids, world_to_pixel_array):
+        """Renders the waypoints registered for the given actors"""
+        width = int(math.ceil(2.0 * self.map_image.scale))
+        rects = []
+        for actor_id in actor_ids:
+            points = world_to_pixel_array(self.actor_waypoints[actor_id]).tolist()
+            rects.append(pygame.draw.lines(surface, (255, 0, 0), False, points, width))
+        return rects
 
     def render_vehicles_ids(
         self,
         vehicle_id_surface,
         list_actors,
-        world_to_pixel,
+        world_to_pixel_array,
         hero_actor,
         hero_transform,
     ):
         """When flag enabled, it shows the IDs of the vehicles that are spawned in the world. Depending on the vehicle type,
-        it will render it in different colors"""
-
-        vehicle_id_surface.fill(COLOR_BLACK)
+        it will render it in different colors. Returns the drawn rects"""
+        rects = []
         if self.show_actor_ids:
             vehicle_id_surface.set_alpha(150)
-            for actor in list_actors:
-                x, y = world_to_pixel(actor[1].location)
-
-                angle = 0
-                if hero_actor is not None:
-                    angle = -hero_transform.rotation.yaw - 90
-
-                color = COLOR_SKY_BLUE_0
-                if int(actor[0].attributes["number_of_wheels"]) == 2:
-                    color = COLOR_CHOCOLATE_0
-                if actor[0].attributes["role_name"] == "hero":
-                    color = COLOR_CHAMELEON_0
-
-                font_surface = pygame.font.Font(
-                    pygame.font.get_default_font(), 20
-                ).render(str(actor[0].id), True, color)
-                rotated_font_surface = pygame.transform.rotate(font_surface, angle)
+            angle = 0
+            if hero_actor is not None:
+                angle = -hero_transform.rotation.yaw - 90
+
+            positions = world_to_pixel_array(self.actor_state.locations(list_actors))
+            for i, (x, y) in zip(list_actors, positions.tolist()):
+                info = self.actor_state.infos[i]
+                rotated_font_surface = self.label_cache.render(
+                    info.label, info.label_color, 20, angle
+                )
                 rect = rotated_font_surface.get_rect(center=(x, y))
-                vehicle_id_surface.blit(rotated_font_surface, rect)
-
-        return vehicle_id_surface
+                rects.append(vehicle_id_surface.blit(rotated_font_surface, rect))
+
+        return rects
+
+    def _cull_bounds(self, clipping_rect):
+        """Returns the world coordinates of the left, top, right and bottom sides of the clipping rect grown by a
+        margin"""
+        margin = self.map_image.world_to_pixel_width(ACTOR_CULL_MARGIN)
+        rect = clipping_rect.inflate(2 * margin, 2 * margin)
+        left, top = self.map_image.pixel_to_world(rect.topleft)
+        right, bottom = self.map_image.pixel_to_world(rect.bottomright)
+        return left, top, right, bottom
+
+    def _cull_actors(self, category, clipping_rect):
+        """Returns the rows of the actors of a category inside the clipping rect grown by a margin"""
+        left, top, right, bottom = self._cull_bounds(clipping_rect)
+        return self.spatial_index.query_rect(left, top, right, bottom, category)
+
+    def _cull_routes(self, clipping_rect):
+        """Returns the ids of the actors in the current tick whose registered waypoints cross the clipping rect grown
+        by a margin. Routes are culled by their own bounds, so the route of a vehicle outside the view is still
+        drawn where it crosses the view"""
+        if not self.actor_waypoints:
+            return []
+        left, top, right, bottom = self._cull_bounds(clipping_rect)
+        present = set(self.actor_state.ids.tolist())
+        routes = []
+        for actor_id, bounds in self.actor_waypoint_bounds.items():
+            low_x, low_y, high_x, high_y = bounds
+            if actor_id not in present:
+                continue
+            if low_x <= right and high_x >= left and low_y <= bottom and high_y >= top:
+                routes.append(actor_id)
+        return routes
+
+    def render_actors(
+        self,
+        surface,
+        vehicles,
+        traffic_lights,
+        speed_limits,
+        walkers,
+        affected=(),
+        offset=(0, 0),
+        routes=(),
+    ):
+        """Renders all the actors, and the waypoints registered for the actors in routes, and returns the rects of
+        the surface they were drawn in. Offset is the pixel of the scaled map at the top left corner of the
+        surface"""
+        world_to_pixel_array = functools.partial(
+            self.map_image.world_to_pixel_array, offset=offset
+        )
 
-    def render_actors(self, surface, vehicles, traffic_lights, speed_limits, walkers):
-        """Renders all the actors"""
         # Static actors
-        self._render_traffic_lights(
-            surface, [tl[0] for tl in traffic_lights], self.map_image.world_to_pixel
+        rects = self._render_traffic_lights(
+            surface, traffic_lights, world_to_pixel_array, affected
         )
-        self._render_speed_limits(
+        rects += self._render_speed_limits(
             surface,
-            [sl[0] for sl in speed_limits],
-            self.map_image.world_to_pixel,
+            speed_limits,
+            world_to_pixel_array,
             self.map_image.world_to_pixel_width,
         )
 
         # Dynamic actors
-        self._render_vehicles(surface, vehicles, self.map_image.world_to_pixel)
-        self._render_walkers(surface, walkers, self.map_image.world_to_pixel)
+        rects += self._render_vehicles(surface, vehicles, world_to_pixel_array)
+        rects += self._render_routes(surface, routes, world_to_pixel_array)
+        rects += self._render_walkers(surface, walkers, world_to_pixel_array)
+        return rects
 
     def register_actor_waypoints_to_draw(self, actor, waypoints):
-        self.actor_waypoints[actor.id] = waypoints
+        points = np.array(
+            [(p.x, p.y, p.z) for p in waypoints], dtype=np.float64
+        ).reshape(-1, 3)
+        if len(points) < 2:
+            # A single point draws no line
+            self.actor_waypoints.pop(actor.id, None)
+            self.actor_waypoint_bounds.pop(actor.id, None)
+            return
+        self.actor_waypoints[actor.id] = points
+        self.actor_waypoint_bounds[actor.id] = tuple(
+            points[:, :2].min(axis=0).tolist() + points[:, :2].max(axis=0).tolist()
+        )
 
-    def clip_surfaces(self, clipping_rect):
+    def _clear_rects(self, surface, rects):
+        """Clears the given rects of a surface, regardless of its clipping rect"""
+        clip = surface.get_clip()
+        surface.set_clip(None)
+        for rect in rects:
+            surface.fill(COLOR_BLACK, rect)
+        surface.set_clip(clip)
+
+    def _get_dirty_rects(self, clipping_rect, rects):
+        """Returns the regions of the result surface that have to be composited again. That is the whole view if
+        the clipping rect changed, or the rects drawn in this and the previous frame otherwise"""
+        view_rect = pygame.Rect((0, 0), clipping_rect.size)
+        view = (tuple(clipping_rect), self.map_image.scale)
+        previous_view = self._composited_view
+        self._composited_view = view
+        if view != previous_view:
+            return [view_rect]
+
+        dirty = [r.clip(view_rect) for r in rects]
+        dirty = [r for r in dirty if r.width > 0 and r.height > 0]
+        if len(dirty) > DIRTY_RECTS_LIMIT:
+            # Compositing many small regions is slower than compositing the
+            # region that contains all of them
+            return [dirty[0].unionall(dirty[1:])]
+        return dirty
+
+    def clip_surfaces(self, view_rect):
         """Used to improve perfomance. Clips the surfaces in order to render only the part of the surfaces that are going to be visible"""
-        self.actors_surface.set_clip(clipping_rect)
-        self.vehicle_id_surface.set_clip(clipping_rect)
-        self.result_surface.set_clip(clipping_rect)
+        self.actors_surface.set_clip(view_rect)
+        self.vehicle_id_surface.set_clip(view_rect)
+        self.result_surface.set_clip(view_rect)
 
     def _compute_scale(self, scale_factor):
         """Based on the mouse wheel and mouse position, it will compute the scale and move the map so that it is zoomed in or out based on mouse position"""
@@ -1064,12 +1349,10 @@ class World(object):
 
     def render(self, display):
         """Renders the map and all the actors in hero and map mode"""
-        if self.actors_with_transforms is None:
+        if self.frame is None:
             return
-        self.result_surface.fill(COLOR_BLACK)
-
-        # Split the actors by vehicle type id
-        vehicles, traffic_lights, speed_limits, walkers = self._split_actors()
+        profiler = self.profiler
+        profiler.mark()
 
         # Zoom in and out
         scale_factor = self._input.wheel_offset
@@ -1077,35 +1360,8 @@ class World(object):
         if self.scaled_size != self.prev_scaled_size:
             self._compute_scale(scale_factor)
 
-        # Render Actors
-        self.actors_surface.fill(COLOR_BLACK)
-        self.render_actors(
-            self.actors_surface, vehicles, traffic_lights, speed_limits, walkers
-        )
-
-        # Render Ids
-        self.render_vehicles_ids(
-            self.vehicle_id_surface,
-            vehicles,
-            self.map_image.world_to_pixel,
-            self.hero_actor,
-            self.hero_transform,
-        )
-        # Show nearby actors from hero mode
-        # self._show_nearby_vehicles(vehicles)
-
-        # Blit surfaces
-        surfaces = (
-            (self.map_image.surface, (0, 0)),
-            (self.actors_surface, (0, 0)),
-            (self.vehicle_id_surface, (0, 0)),
-        )
-
-        angle = (
-            0.0 if self.hero_actor is None else self.hero_transform.rotation.yaw + 90.0
-        )
-        self.traffic_light_surfaces.rotozoom(-angle, self.map_image.scale)
-
+        # The clipping rect is the visible region of the map, in pixels of the
+        # scaled map
         center_offset = (0, 0)
         if self.hero_actor is not None:
             # Hero Mode
@@ -1124,33 +1380,12 @@ class World(object):
                 ),
             )
 
-            # Apply clipping rect
             clipping_rect = pygame.Rect(
                 translation_offset[0],
                 translation_offset[1],
                 self.hero_surface.get_width(),
                 self.hero_surface.get_height(),
             )
-            self.clip_surfaces(clipping_rect)
-
-            Util.blits(self.result_surface, surfaces)
-
-            self.border_round_surface.set_clip(clipping_rect)
-
-            self.hero_surface.fill(COLOR_ALUMINIUM_4)
-            self.hero_surface.blit(
-                self.result_surface, (-translation_offset[0], -translation_offset[1])
-            )
-
-            rotated_result_surface = pygame.transform.rotozoom(
-                self.hero_surface, angle, 0.9
-            ).convert()
-
-            center = (display.get_width() / 2, display.get_height() / 2)
-            rotation_pivot = rotated_result_surface.get_rect(center=center)
-            display.blit(rotated_result_surface, rotation_pivot)
-
-            display.blit(self.border_round_surface, (0, 0))
         else:
             # Map Mode
             # Translation offset
@@ -1163,22 +1398,114 @@ class World(object):
                 0,
             )
 
-            # Apply clipping rect
             clipping_rect = pygame.Rect(
                 -translation_offset[0] - center_offset[0],
                 -translation_offset[1],
                 self.dim[0],
                 self.dim[1],
             )
-            self.clip_surfaces(clipping_rect)
-            Util.blits(self.result_surface, surfaces)
 
-            display.blit(
-                self.result_surface,
-                (translation_offset[0] + center_offset[0], translation_offset[1]),
+        # The actor and result surfaces hold the clipping rect only, with its
+        # top left corner at their origin
+        origin = clipping_rect.topleft
+        view_rect = pygame.Rect((0, 0), clipping_rect.size)
+
+        # Clear the actors drawn in the previous frame, the rest of the actor
+        # surfaces is already clear, and apply clipping rect
+        self._clear_rects(self.actors_surface, self._actor_rects)
+        self._clear_rects(self.vehicle_id_surface, self._id_rects)
+        self.clip_surfaces(view_rect)
+        profiler.lap("render.clear")
+
+        # Traffic lights are checked against the hero even when they are not
+        # visible, the rest of the work is only done for visible actors
+        affected = self._find_affected_traffic_lights()
+        vehicles = self._cull_actors(ACTOR_VEHICLE, clipping_rect)
+        traffic_lights = self._cull_actors(ACTOR_TRAFFIC_LIGHT, clipping_rect)
+        speed_limits = self._cull_actors(ACTOR_SPEED_LIMIT, clipping_rect)
+        walkers = self._cull_actors(ACTOR_WALKER, clipping_rect)
+        routes = self._cull_routes(clipping_rect)
+        profiler.lap("render.cull")
+
+        # Render Actors
+        previous_rects = self._actor_rects + self._id_rects
+        self._actor_rects = self.render_actors(
+            self.actors_surface,
+            vehicles,
+            traffic_lights,
+            speed_limits,
+            walkers,
+            affected,
+            origin,
+            routes,
+        )
+        profiler.lap("render.actors")
+
+        # Render Ids
+        self._id_rects = self.render_vehicles_ids(
+            self.vehicle_id_surface,
+            vehicles,
+            functools.partial(self.map_image.world_to_pixel_array, offset=origin),
+            self.hero_actor,
+            self.hero_transform,
+        )
+        profiler.lap("render.ids")
+        angle = (
+            0.0 if self.hero_actor is None else self.hero_transform.rotation.yaw + 90.0
+        )
+        self.traffic_light_surfaces.rotozoom(-angle, self.map_image.scale)
+        profiler.lap("render.lights")
+
+        # Composite the map tiles and the actor surfaces only where something
+        # changed since the previous frame
+        dirty_rects = self._get_dirty_rects(
+            clipping_rect, previous_rects + self._actor_rects + self._id_rects
+        )
+        for rect in dirty_rects:
+            self.result_surface.set_clip(rect)
+            self.result_surface.fill(COLOR_BLACK)
+            self.map_image.blit_visible(self.result_surface, rect.move(origin), origin)
+            surfaces = (
+                (self.actors_surface, rect.topleft),
+                (self.vehicle_id_surface, rect.topleft),
             )
+            Util.blits(self.result_surface, surfaces, rect)
+        self.result_surface.set_clip(view_rect)
+        profiler.lap("render.composite")
+
+        if self.hero_actor is not None:
+            # Hero Mode
+            self.border_round_surface.set_clip(clipping_rect)
+            self._render_hero_view(display, angle)
+            display.blit(self.border_round_surface, (0, 0))
+        else:
+            # Map Mode
+            display.blit(self.result_surface, (0, 0), view_rect)
+        profiler.lap("render.view")
+
+    def _render_hero_view(self, display, angle):
+        """Blits the region of the result surface around the hero, rotated so that the hero faces up. The region is
+        shrunk into a preallocated surface and rotated without smoothing, which costs a fraction of a smoothed
+        rotozoom"""
+        self.hero_surface.fill(COLOR_ALUMINIUM_4)
+        self.hero_surface.blit(self.result_surface, (0, 0))
+        pygame.transform.scale(
+            self.hero_surface, self._hero_view_surface.get_size(), self._hero_view_surface
+        )
+        hero_view = pygame.transform.rotate(self._hero_view_surface, angle)
+
+        # Only the square around the round border is visible, the rest of the
+        # display is covered by the border
+        side = min(display.get_width(), display.get_height())
+        area = pygame.Rect(0, 0, side, side)
+        area.center = hero_view.get_rect().center
+        target = area.copy()
+        target.center = display.get_rect().center
+        display.blit(hero_view, target, area)
 
     def destroy(self):
-        """Destroy the hero actor when class instance is destroyed"""
+        """Destroy the hero actor and releases the map tiles when class instance is destroyed"""
         if self.spawned_hero is not None:
             self.spawned_hero.destroy()
+        if self.map_image is not None:
+            self.map_image.close()
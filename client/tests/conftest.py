@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The client modules are imported as the app package, as run.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,185 @@
+import math
+
+import numpy as np
+import pytest
+
+from app import controller
+from app.benchmark import StubActor
+from app.controller import (
+    get_target_point,
+    get_target_point_reference,
+    PurePursuitController,
+    BatchPurePursuitController,
+)
+
+# Largest distance, in meters, between the target points of both versions,
+# they only differ in the rounding of the square roots
+MATCH_TOLERANCE = 1e-6
+
+
+@pytest.fixture(params=["loop", "arrays"])
+def loop_size(request, monkeypatch):
+    """Runs a test with the loop path for short polylines, and again with the array operations for all of them"""
+    if request.param == "arrays":
+        monkeypatch.setattr(controller, "TARGET_POINT_LOOP_SIZE", 0)
+    return controller.TARGET_POINT_LOOP_SIZE
+
+
+def assert_same_target(lookahead, polyline):
+    # The reference divides by zero on zero length segments, and drops the
+    # intersections that are not numbers
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = get_target_point_reference(lookahead, list(polyline))
+    actual = get_target_point(lookahead, polyline)
+    if expected is None:
+        assert actual is None
+    else:
+        assert actual is not None
+        assert math.hypot(actual[0] - expected[0], actual[1] - expected[1]) <= MATCH_TOLERANCE
+
+
+def random_polylines(count, seed=0):
+    """Yields lookahead distances and polylines starting at the origin that wander around the lookahead circle"""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        n = int(rng.integers(2, 40))
+        points = np.cumsum(rng.normal(0.0, 4.0, (n, 2)), axis=0)
+        points[0] = 0.0
+        yield float(rng.uniform(8.0, 20.0)), points
+
+
+def test_random_polylines(loop_size):
+    for lookahead, polyline in random_polylines(2000):
+        assert_same_target(lookahead, polyline)
+
+
+def test_random_polylines_with_repeated_points(loop_size):
+    rng = np.random.default_rng(1)
+    for lookahead, polyline in random_polylines(500, seed=1):
+        repeated = rng.integers(0, len(polyline), 3)
+        polyline = np.insert(polyline, repeated, polyline[repeated], axis=0)
+        assert_same_target(lookahead, polyline)
+
+
+def test_zero_length_segments(loop_size):
+    polyline = np.array([(0.0, 0.0), (0.0, 0.0), (5.0, 0.0), (5.0, 0.0), (20.0, 0.0)])
+    assert get_target_point(10.0, polyline) == pytest.approx((10.0, 0.0))
+    assert_same_target(10.0, polyline)
+
+    # A polyline that only stays in place has no target point
+    assert get_target_point(10.0, np.zeros((4, 2))) is None
+    assert_same_target(10.0, np.zeros((4, 2)))
+
+
+@pytest.mark.parametrize("radius", [8.0, 12.5, 20.0])
+def test_tangent_segment(loop_size, radius):
+    # The line x = radius touches the circle at a single point
+    polyline = np.array([(radius, -5.0), (radius, 5.0), (radius + 10.0, 5.0)])
+    assert get_target_point(radius, polyline) == pytest.approx((radius, 0.0))
+    assert_same_target(radius, polyline)
+
+
+@pytest.mark.parametrize("angle", np.linspace(-80.0, 80.0, 9))
+def test_nearly_tangent_segments(loop_size, angle):
+    # Segments tangent to the circle at an angle, and moved slightly inside
+    # and outside of it
+    theta = math.radians(angle)
+    normal = np.array((math.cos(theta), math.sin(theta)))
+    tangent = np.array((-normal[1], normal[0]))
+    for shift in (-1e-6, -1e-9, 0.0, 1e-9, 1e-6):
+        center = (10.0 + shift) * normal
+        polyline = np.array((center - 5.0 * tangent, center + 5.0 * tangent))
+        assert_same_target(10.0, polyline)
+
+
+def test_no_target_behind(loop_size):
+    polyline = np.array([(0.0, 0.0), (-15.0, 0.0), (-15.0, 15.0)])
+    assert get_target_point(10.0, polyline) is None
+    assert get_target_point(10.0, polyline[:1]) is None
+
+
+def test_first_intersection_along_the_polyline(loop_size):
+    # The polyline crosses the circle ahead twice, the first crossing wins
+    polyline = np.array([(0.0, 0.0), (6.0, 12.0), (6.0, -12.0)])
+    target = get_target_point(10.0, polyline)
+    assert target[1] > 0.0
+    assert_same_target(10.0, polyline)
+
+
+def test_waypoints_changed_in_place():
+    actor = StubActor((0.0, 0.0, 0.0), (5.0, 0.0, 0.0))
+    waypoints = [(float(x), 0.0) for x in range(0, 40, 5)]
+    pure_pursuit_controller = PurePursuitController()
+    _, steer = pure_pursuit_controller.get_control(actor, waypoints, 10.0, 0.04)
+    assert steer == pytest.approx(0.0)
+
+    # The same list now turns left
+    waypoints[:] = [(float(x), 0.1 * x * x) for x in range(0, 40, 5)]
+    _, steer = pure_pursuit_controller.get_control(actor, waypoints, 10.0, 0.04)
+    _, expected = PurePursuitController().get_control(actor, waypoints, 10.0, 0.04)
+    assert steer == expected
+    assert steer > 0.1
+
+
+def drive_batch(controller, routes, steps, start=0, indices=None):
+    """Returns the controls of a batch controller for vehicles placed on their route with some lateral offset. If
+    indices is given, routes are the ones of those vehicles only"""
+    controls = []
+    for step in range(start, start + steps):
+        points = np.array([route[min(step, len(route) - 1)] for route in routes])
+        n = len(routes)
+        controls.append(
+            controller.get_control(
+                points[:, 0],
+                points[:, 1] + 0.5,
+                np.zeros(n),
+                np.full(n, 5.0),
+                10.0,
+                0.04,
+                indices,
+            )
+        )
+    return controls
+
+
+def test_batch_controller_keeps_some_vehicles():
+    s = np.arange(0.0, 300.0, 1.0)
+    routes = [np.stack((s, 10.0 * i + np.sin(s / (20.0 + i))), -1) for i in range(4)]
+    controller = BatchPurePursuitController(routes)
+    drive_batch(controller, routes, 30)
+
+    kept = [0, 2, 3]
+    reference = BatchPurePursuitController(routes)
+    drive_batch(reference, routes, 30)
+    controller.keep(kept)
+    for (accel, steer), (expected_accel, expected_steer) in zip(
+        drive_batch(controller, [routes[i] for i in kept], 20, 30),
+        drive_batch(reference, routes, 20, 30),
+    ):
+        np.testing.assert_allclose(accel, expected_accel[kept], rtol=0.0, atol=1e-12)
+        np.testing.assert_allclose(steer, expected_steer[kept], rtol=0.0, atol=1e-12)
+
+
+def test_batch_controller_drives_some_vehicles():
+    s = np.arange(0.0, 300.0, 1.0)
+    routes = [np.stack((s, 10.0 * i + np.sin(s / (20.0 + i))), -1) for i in range(4)]
+    controller = BatchPurePursuitController(routes)
+    reference = BatchPurePursuitController(routes)
+    drive_batch(controller, routes, 30)
+    drive_batch(reference, routes, 30)
+
+    # Vehicle 1 is missing from the next frames, the others are driven as if
+    # it was there and its route and PID state are left as they were
+    driven = np.array([0, 2, 3])
+    cursor = controller.routes.cursor[1]
+    progress = controller.routes.progress[1]
+    int_term = controller.pid.int_term[1]
+    for (accel, steer), (expected_accel, expected_steer) in zip(
+        drive_batch(controller, [routes[i] for i in driven], 20, 30, driven),
+        drive_batch(reference, routes, 20, 30),
+    ):
+        np.testing.assert_allclose(accel, expected_accel[driven], rtol=0.0, atol=1e-12)
+        np.testing.assert_allclose(steer, expected_steer[driven], rtol=0.0, atol=1e-12)
+    assert controller.routes.cursor[1] == cursor
+    assert controller.routes.progress[1] == progress
+    assert controller.pid.int_term[1] == int_term
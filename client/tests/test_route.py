@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from app.route import Route, RouteBatch
+
+
+def hairpin(spacing=1.0):
+    """Route that goes 30 m along the x axis and comes back 4 m to its left"""
+    out = np.arange(0.0, 30.0 + spacing, spacing)
+    back = out[::-1]
+    return np.vstack(
+        (np.stack((out, np.zeros_like(out)), -1), np.stack((back, np.full_like(back, 4.0)), -1))
+    )
+
+
+def test_progress_along_a_straight_route():
+    route = Route([(0.0, 0.0), (10.0, 0.0), (20.0, 0.0)])
+    assert route.update(5.0, 1.0) == pytest.approx(5.0)
+    assert route.cursor == 0
+    assert route.update(15.0, -1.0) == pytest.approx(15.0)
+    assert route.cursor == 1
+    assert not route.finished
+    assert route.update(25.0, 0.0) == pytest.approx(20.0)
+    assert route.finished
+
+
+def test_cursor_does_not_jump_to_the_way_back_of_a_hairpin():
+    route = Route(hairpin())
+
+    # The way back is closer to the location than the way out, but it is
+    # past the first local minimum of the distance
+    route.update(5.0, 2.2)
+    assert route.cursor == 5
+    assert route.progress == pytest.approx(5.0)
+
+
+def test_progress_never_decreases():
+    route = Route(hairpin())
+    route.update(10.0, 0.0)
+    assert route.update(8.0, 0.0) == pytest.approx(10.0)
+
+
+def test_zero_length_segments():
+    route = Route([(0.0, 0.0), (0.0, 0.0), (10.0, 0.0), (10.0, 0.0), (20.0, 0.0)])
+    assert route.update(15.0, 0.5) == pytest.approx(15.0)
+    assert route.cursor == 3
+
+
+def test_window_covers_the_lookahead_after_a_long_segment():
+    route = Route([(0.0, 0.0), (80.0, 0.0), (81.0, 0.0), (200.0, 0.0)])
+    route.update(75.0, 0.0)
+    window = route.window()
+    assert window[-1, 0] >= 75.0 + route.window_length
+
+
+def test_batch_follows_each_route():
+    rng = np.random.default_rng(0)
+    waypoints = [hairpin(), hairpin(0.5) + (100.0, 0.0)]
+    waypoints.append(np.cumsum(rng.uniform(0.0, 3.0, (200, 2)), axis=0))
+    routes = [Route(w) for w in waypoints]
+    batch = RouteBatch(waypoints)
+
+    # Vehicles drive along their route with some lateral noise
+    for step in range(150):
+        x = []
+        y = []
+        for route, points in zip(routes, waypoints):
+            point = points[min(step // 2, len(points) - 1)]
+            x.append(point[0] + rng.normal(0.0, 0.8))
+            y.append(point[1] + rng.normal(0.0, 0.8))
+            route.update(x[-1], y[-1])
+        batch.update(np.array(x), np.array(y))
+        # Progress is offset by the start of each route in the batch
+        np.testing.assert_allclose(
+            batch.progress, [route.progress for route in routes], rtol=0.0, atol=1e-9
+        )
+        assert (batch.cursor - batch.first).tolist() == [route.cursor for route in routes]
+        owner, index = batch.window()
+        for i, route in enumerate(routes):
+            np.testing.assert_array_equal(batch.points[index[owner == i]], route.window())